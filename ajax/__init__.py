@@ -3,5 +3,7 @@ from ajax.endpoints import Endpoints
 from ajax.encoders import Encoders
 
 
+default_app_config = 'ajax.apps.AjaxConfig'
+
 endpoint = Endpoints()
 encoder = Encoders()
@@ -0,0 +1,14 @@
+from __future__ import absolute_import
+from django.apps import AppConfig
+from django.core import checks
+
+
+class AjaxConfig(AppConfig):
+    name = 'ajax'
+
+    def ready(self):
+        from ajax.checks import check_endpoint_fields, check_endpoint_indexes
+        from ajax.dispatch import table
+        checks.register(check_endpoint_fields)
+        checks.register(check_endpoint_indexes)
+        table.build()
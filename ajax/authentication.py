@@ -1,6 +1,94 @@
+from __future__ import absolute_import
+import copy
+
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.utils import timezone
+
+from ajax.compat import get_cache
+from ajax.conf import settings
+from ajax.utils import ExpiringLRUCache
+
+
 class BaseAuthentication(object):
     def is_authenticated(self, request, application, method):
         if request.user.is_authenticated():
             return True
 
         return False
+
+
+class APIKeyAuthentication(BaseAuthentication):
+    """Authenticates machine clients with an ``ajax.models.APIKey``.
+
+    The key is read from an ``Authorization: Bearer <key>`` (or ``Token``)
+    header or from the ``AJAX_API_KEY_HEADER`` header, and ``request.user``
+    becomes the key's user. Requests without a key fall back to the session.
+
+    Verified keys are kept in a process-local cache for
+    ``AJAX_API_KEY_CACHE_TIMEOUT`` seconds, so known keys cost no queries.
+    Saving or deleting an ``APIKey`` bumps a version in the ``AJAX_CACHE``
+    cache, which makes every process verify its keys again. Keys are not
+    kept when ``AJAX_CACHE`` isn't shared between processes (local memory
+    or dummy caches), since other processes would miss revocations.
+    """
+    # Caches whose version other processes can't see.
+    unshared_caches = (LocMemCache, DummyCache)
+    schemes = ('bearer', 'token')
+
+    def __init__(self):
+        self.keys = ExpiringLRUCache(settings.AJAX_API_KEY_CACHE_SIZE)
+
+    def is_authenticated(self, request, application, method):
+        key = self.get_key(request)
+        if key is None:
+            return super(APIKeyAuthentication, self).is_authenticated(
+                request, application, method)
+
+        user = self.get_user(key)
+        if user is None:
+            return False
+
+        request.user = user
+        return True
+
+    def get_key(self, request):
+        authorization = request.META.get('HTTP_AUTHORIZATION', '').split()
+        if len(authorization) == 2 and \
+            authorization[0].lower() in self.schemes:
+            return authorization[1]
+
+        header = 'HTTP_' + settings.AJAX_API_KEY_HEADER.upper().replace('-',
+            '_')
+        return request.META.get(header) or None
+
+    def get_user(self, key):
+        """Return the active user ``key`` belongs to, or ``None``."""
+        from ajax.models import APIKey, API_KEYS_VERSION, hash_key
+
+        digest = hash_key(key)
+        cache = get_cache(settings.AJAX_CACHE)
+        shared = not isinstance(cache, self.unshared_caches)
+        if shared:
+            version = cache.get(API_KEYS_VERSION, 0)
+            cached = self.keys.get(digest)
+            if cached is not None and cached[0] == version:
+                # Every request gets its own copy to change.
+                return copy.copy(cached[1])
+
+        try:
+            api_key = APIKey.objects.select_related('user').get(
+                hashed_key=digest)
+        except APIKey.DoesNotExist:
+            return None
+
+        if not api_key.is_valid() or not api_key.user.is_active:
+            return None
+
+        if shared:
+            ttl = settings.AJAX_API_KEY_CACHE_TIMEOUT
+            if api_key.expires is not None:
+                ttl = min(ttl,
+                    (api_key.expires - timezone.now()).total_seconds())
+            self.keys.set(digest, (version, api_key.user), ttl)
+        return copy.copy(api_key.user)
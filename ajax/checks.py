@@ -0,0 +1,90 @@
+from __future__ import absolute_import
+
+from django.core import checks
+
+import ajax
+
+
+def _indexed_fields(model):
+    """Return the names of the fields that lead an index of ``model``."""
+    opts = model._meta
+    indexed = set(['pk'])
+    for field in opts.fields:
+        if field.primary_key or field.unique or field.db_index:
+            indexed.add(field.name)
+
+    for fields in list(opts.index_together) + list(opts.unique_together):
+        indexed.add(fields[0])
+    for index in getattr(opts, 'indexes', []):
+        if index.fields:
+            indexed.add(index.fields[0].lstrip('-'))
+    return indexed
+
+
+def _endpoints(app_configs):
+    """Yield ``(endpoint_class, model)`` for the registered endpoints."""
+    registry = ajax.endpoint._registry
+    for key, model in sorted(ajax.endpoint._index.items()):
+        if app_configs is not None and \
+            model._meta.app_config not in app_configs:
+            continue
+        yield registry[model], model
+
+
+def _ordering_names(endpoint_class):
+    names = list(endpoint_class.order_fields)
+    names.extend(endpoint_class.cursor_ordering)
+    return [name.lstrip('-') for name in names]
+
+
+def check_endpoint_fields(app_configs=None, **kwargs):
+    """Report ``filter_fields`` and orderings naming fields that don't exist.
+
+    Filters need a concrete field of the model to convert values with and
+    orderings one to sort by, or requests using them fail with a 500.
+    """
+    errors = []
+    for endpoint_class, model in _endpoints(app_configs):
+        fields = set(field.name for field in model._meta.fields)
+        invalid = set(endpoint_class.filter_fields) - fields
+        invalid.update(set(_ordering_names(endpoint_class)) - fields -
+            set(['pk']))
+        for name in sorted(invalid):
+            errors.append(checks.Error(
+                '%s filters or orders %s by "%s", which is not a concrete '
+                'field of the model.' % (endpoint_class.__name__,
+                    model.__name__, name),
+                obj=endpoint_class,
+                id='ajax.E001',
+            ))
+
+    return errors
+
+
+def check_endpoint_indexes(app_configs=None, **kwargs):
+    """Warn about filters and orderings that would scan the whole table.
+
+    Every field in ``filter_fields`` and ``order_fields``, and the first
+    field of ``cursor_ordering``, should lead a database index.
+    """
+    warnings = []
+    for endpoint_class, model in _endpoints(app_configs):
+        names = list(endpoint_class.filter_fields)
+        names.extend(name.lstrip('-') for name in endpoint_class.order_fields)
+        names.extend(name.lstrip('-')
+            for name in endpoint_class.cursor_ordering[:1])
+
+        # Names that aren't fields at all are reported by ajax.E001.
+        fields = set(field.name for field in model._meta.fields)
+        indexed = _indexed_fields(model)
+        for name in sorted((set(names) & fields) - indexed):
+            warnings.append(checks.Warning(
+                '%s filters or orders %s by "%s", which has no database '
+                'index.' % (endpoint_class.__name__, model.__name__, name),
+                hint='Add db_index=True to the field or an index that '
+                    'starts with it.',
+                obj=endpoint_class,
+                id='ajax.W001',
+            ))
+
+    return warnings
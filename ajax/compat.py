@@ -2,11 +2,89 @@ from __future__ import absolute_import
 import django
 
 if django.VERSION >= (1, 7):
+    from django.apps import apps
+    from django.core.cache import caches
     from django.utils.module_loading import import_string as path_to_import
     from importlib import import_module
     from logging import getLogger
+
+    def get_app_modules():
+        """Return ``(label, module name)`` for every installed application."""
+        return [(config.label, config.name)
+            for config in apps.get_app_configs()]
+
+    def get_cache(alias):
+        return caches[alias]
 else:
     # 1.4 LTS compatibility
     from ajax.utils import import_by_path as path_to_import
+    from django.conf import settings
+    from django.core.cache import get_cache
     from django.utils.importlib import import_module
     from django.utils.log import getLogger
+
+    def get_app_modules():
+        """Return ``(label, module name)`` for every installed application."""
+        return [(name.rsplit('.', 1)[-1], name)
+            for name in settings.INSTALLED_APPS]
+
+if django.VERSION >= (1, 10):
+    from django.db.models import prefetch_related_objects
+else:
+    from django.db.models.query import prefetch_related_objects as \
+        _prefetch_related_objects
+
+    def prefetch_related_objects(model_instances, *related_lookups):
+        return _prefetch_related_objects(model_instances, related_lookups)
+
+if django.VERSION >= (2, 0):
+    def queryset_iterator(queryset, chunk_size):
+        return queryset.iterator(chunk_size=chunk_size)
+else:
+    def queryset_iterator(queryset, chunk_size):
+        # Older versions always fetch GET_ITERATOR_CHUNK_SIZE rows at a time.
+        return queryset.iterator()
+
+if django.VERSION >= (1, 11):
+    from django.core.exceptions import EmptyResultSet
+else:
+    from django.db.models.sql.datastructures import EmptyResultSet
+
+if django.VERSION >= (2, 0):
+    from contextlib import contextmanager
+    from timeit import default_timer
+
+    @contextmanager
+    def track_queries(connection, callback):
+        """Call ``callback(seconds)`` for every query run on ``connection``."""
+        def wrapper(execute, sql, params, many, context):
+            start = default_timer()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                callback(default_timer() - start)
+
+        with connection.execute_wrapper(wrapper):
+            yield
+else:
+    from contextlib import contextmanager
+
+    @contextmanager
+    def track_queries(connection, callback):
+        """Call ``callback(seconds)`` for every query run on ``connection``."""
+        if not hasattr(connection, 'queries_log'):
+            yield
+            return
+
+        # There is no execute_wrapper(), so have the debug cursor log the
+        # queries and read them back. Queries logged while the log is full
+        # are missed.
+        force_debug_cursor = connection.force_debug_cursor
+        connection.force_debug_cursor = True
+        start = len(connection.queries_log)
+        try:
+            yield
+        finally:
+            connection.force_debug_cursor = force_debug_cursor
+            for query in list(connection.queries_log)[start:]:
+                callback(float(query['time']))
@@ -5,3 +5,19 @@ from appconf import AppConf
 
 class AjaxAppConf(AppConf):
     AJAX_AUTHENTICATION = 'ajax.authentication.BaseAuthentication'
+    AJAX_JSON_BACKEND = 'json'
+    AJAX_BATCH_MAX_OPERATIONS = 50
+    AJAX_CACHE = 'default'
+    AJAX_METRICS = False
+    AJAX_METRICS_SINKS = ()
+    AJAX_METRICS_STATSD_HOST = 'localhost'
+    AJAX_METRICS_STATSD_PORT = 8125
+    AJAX_METRICS_STATSD_PREFIX = 'ajax'
+    AJAX_PROFILE_DIR = None
+    AJAX_PROFILE_RATE = 0
+    AJAX_PROFILE_HEADER = 'X-AJAX-Profile'
+    AJAX_PROFILER = 'cprofile'
+    AJAX_PROFILE_INTERVAL = 0.001
+    AJAX_API_KEY_HEADER = 'X-API-Key'
+    AJAX_API_KEY_CACHE_TIMEOUT = 300
+    AJAX_API_KEY_CACHE_SIZE = 1000
@@ -5,8 +5,10 @@ from django.http import Http404
 from django.conf import settings
 from decorator import decorator
 from ajax.exceptions import AJAXError, PrimaryKeyMissing
+from ajax.profiling import profile, should_profile
 from functools import wraps
 from django.utils.decorators import available_attrs
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
 
 
 logger = getLogger('django.request')
@@ -39,6 +41,86 @@ def allowed_methods(*args,**kwargs):
         return inner
     return decorator        
     
+def read_only(func=None, cache_control=None, vary=()):
+    """Mark an ad-hoc endpoint as safe to call with GET.
+
+    Read-only endpoints accept GET requests, with their parameters in the
+    query string, and get an ``ETag``. ``cache_control`` is a dict of
+    ``Cache-Control`` directives for GET responses (defaults to
+    ``{'private': True}``) and ``vary`` lists headers to add to ``Vary``.
+    Works both as ``@read_only`` and ``@read_only(cache_control={...})``.
+    """
+    def mark(func):
+        func.ajax_read_only = True
+        func.ajax_cache_control = cache_control
+        func.ajax_vary = tuple(vary)
+        return func
+
+    if func is not None:
+        return mark(func)
+    return mark
+
+
+def budget(queries=None, memory=None):
+    """Declare the most queries and bytes of peak memory an ad-hoc endpoint
+    may use, for ``ajax.testing`` to check."""
+    def mark(func):
+        func.ajax_budget = (queries, memory)
+        return func
+    return mark
+
+
+def api_key_csrf_exempt(view):
+    """Skip the CSRF check for requests authenticated with an API key.
+
+    Keys are read and verified by the ``AJAX_AUTHENTICATION`` class and
+    ``request.user`` becomes the key's user, so ad-hoc endpoints act as that
+    user as well. Requests with an invalid key are rejected with a 403,
+    errors looking keys up become the usual JSON error response and
+    requests without a key are still checked when ``CsrfViewMiddleware`` is
+    installed.
+    """
+    protected = csrf_protect(view)
+
+    @csrf_exempt
+    @wraps(view, assigned=available_attrs(view))
+    def inner(request, *args, **kwargs):
+        from ajax.endpoints import ModelEndpoint
+        authentication = ModelEndpoint.authentication
+        # This runs outside of json_response, so errors are turned into
+        # JSON here.
+        try:
+            key = None
+            if hasattr(authentication, 'get_key'):
+                key = authentication.get_key(request)
+
+            user = None
+            if key is not None:
+                user = authentication.get_user(key)
+                if user is None:
+                    raise AJAXError(403, _('Invalid API key.'))
+        except Exception as e:
+            response = error_from_exception(request, e).get_response()
+            response['Content-Type'] = 'application/json'
+            return response
+
+        if key is None:
+            if _csrf_middleware_installed():
+                return protected(request, *args, **kwargs)
+            return view(request, *args, **kwargs)
+
+        request.user = user
+        return view(request, *args, **kwargs)
+    return inner
+
+
+def _csrf_middleware_installed():
+    middleware = getattr(settings, 'MIDDLEWARE', None)
+    if middleware is None:
+        middleware = getattr(settings, 'MIDDLEWARE_CLASSES', ())
+    return 'django.middleware.csrf.CsrfViewMiddleware' in middleware
+
+
 @decorator
 def json_response(f, *args, **kwargs):
     """Wrap a view in JSON.
@@ -57,15 +139,34 @@ def json_response(f, *args, **kwargs):
 
     Please keep in mind that raw exception messages could very well be exposed
     to the client if a non-AJAXError is thrown.
+
+    Requests can be profiled, see ``ajax.profiling``.
     """
+    if should_profile(args[0]):
+        return profile(args[0], _json_response, f, *args, **kwargs)
+    return _json_response(f, *args, **kwargs)
+
+
+def _json_response(f, *args, **kwargs):
     try:
         result = f(*args, **kwargs)
         if isinstance(result, AJAXError):
             raise result
-    except AJAXError as e:
-        result = e.get_response()
+    except Exception as e:
+        result = error_from_exception(args[0], e).get_response()
+
+    result['Content-Type'] = 'application/json'
+    return result
 
-        request = args[0]
+
+def error_from_exception(request, e):
+    """Turn an exception raised by an endpoint into an ``AJAXError``.
+
+    This must be called from the ``except`` block handling ``e``. The error
+    is logged the same way for every endpoint. Unknown exceptions become a
+    500 which, when ``DEBUG`` is on, carries the traceback.
+    """
+    if isinstance(e, AJAXError):
         logger.warn('AJAXError: %d %s - %s', e.code, request.path, e.msg,
             exc_info=True,
             extra={
@@ -73,28 +174,26 @@ def json_response(f, *args, **kwargs):
                 'request': request
             }
         )
-    except Http404 as e:
-        result = AJAXError(404, e.__str__()).get_response()
-    except Exception as e:
-        import sys
-        exc_info = sys.exc_info()
-        type, message, trace = exc_info
-        if settings.DEBUG:
-            import traceback
-            tb = [{'file': l[0], 'line': l[1], 'in': l[2], 'code': l[3]} for
-                l in traceback.extract_tb(trace)]
-            result = AJAXError(500, message, traceback=tb).get_response()
-        else:
-            result = AJAXError(500, "Internal server error.").get_response()
-
-        request = args[0]
-        logger.error('Internal Server Error: %s' % request.path,
-            exc_info=exc_info,
-            extra={
-                'status_code': 500,
-                'request': request
-            }
-        )
-
-    result['Content-Type'] = 'application/json'
-    return result
+        return e
+    elif isinstance(e, Http404):
+        return AJAXError(404, e.__str__())
+
+    import sys
+    exc_info = sys.exc_info()
+    type, message, trace = exc_info
+    if settings.DEBUG:
+        import traceback
+        tb = [{'file': l[0], 'line': l[1], 'in': l[2], 'code': l[3]} for
+            l in traceback.extract_tb(trace)]
+        error = AJAXError(500, message, traceback=tb)
+    else:
+        error = AJAXError(500, "Internal server error.")
+
+    logger.error('Internal Server Error: %s' % request.path,
+        exc_info=exc_info,
+        extra={
+            'status_code': 500,
+            'request': request
+        }
+    )
+    return error
@@ -0,0 +1,178 @@
+from __future__ import absolute_import
+import inspect
+
+from django.utils.module_loading import module_has_submodule
+from django.utils.translation import ugettext as _
+
+from ajax.compat import get_app_modules, getLogger, import_module
+from ajax.exceptions import AJAXError
+import ajax
+
+
+logger = getLogger('django.request')
+
+
+def _adhoc_endpoints(module):
+    """Yield ``(name, callable)`` for the ad-hoc endpoints in ``module``.
+
+    When the module has no ``__all__``, functions imported from elsewhere
+    (decorators, helpers) and classes are skipped. A warning is logged for
+    skipped functions that don't come from Django or this package, since
+    they may be endpoints wrapped by a decorator that doesn't use
+    ``functools.wraps``.
+    """
+    names = getattr(module, '__all__', None)
+    explicit = names is not None
+    if not explicit:
+        names = [name for name in dir(module) if not name.startswith('_')]
+
+    for name in names:
+        func = getattr(module, name, None)
+        if not callable(func) or inspect.isclass(func):
+            continue
+        if not explicit and inspect.isfunction(func) and \
+            func.__module__ != module.__name__:
+            if not (func.__module__ or '').startswith(('django.', 'ajax.')):
+                logger.warning('%s.%s is not exposed as an endpoint because '
+                    'it is defined in %s. Add it to __all__ to expose it.',
+                    module.__name__, name, func.__module__)
+            continue
+        yield name, func
+
+
+class AdHocRoute(object):
+    """Route to an ad-hoc endpoint found in an application's endpoints.py."""
+    def __init__(self, func):
+        self.func = func
+        read_only = getattr(func, 'ajax_read_only', False)
+        self.conditional = read_only  # Whether responses get an ETag.
+        self.allow_get = read_only
+        self.cache_control = getattr(func, 'ajax_cache_control', None)
+        self.vary = getattr(func, 'ajax_vary', ())
+
+    def __call__(self, request, application, **kwargs):
+        return self.func(request)
+
+    def __str__(self):
+        return '%s.%s' % (getattr(self.func, '__module__', '?'),
+            getattr(self.func, '__name__', self.func.__class__.__name__))
+
+
+class ModelRoute(object):
+    """Route to a method of a registered ``ModelEndpoint``."""
+    def __init__(self, endpoint_class, model, method):
+        self.endpoint_class = endpoint_class
+        self.model = model
+        self.method = method
+
+    # Read off the class on every request so they can be changed at runtime.
+    @property
+    def conditional(self):
+        return self.method in self.endpoint_class.read_methods
+
+    @property
+    def allow_get(self):
+        return self.conditional and self.endpoint_class.allow_get
+
+    @property
+    def cache_control(self):
+        return self.endpoint_class.http_cache_control
+
+    @property
+    def vary(self):
+        return self.endpoint_class.http_vary
+
+    def __call__(self, request, application, **kwargs):
+        endpoint = self.endpoint_class(application, self.model, self.method,
+            **kwargs)
+        if not endpoint.authenticate(request, application, self.method):
+            raise AJAXError(403, _('User is not authorized.'))
+
+        return getattr(endpoint, self.method)(request)
+
+    def __str__(self):
+        return '%s.%s.%s' % (self.endpoint_class.__module__,
+            self.endpoint_class.__name__, self.method)
+
+
+class DispatchTable(object):
+    """Maps ``(application, name, method)`` to a ready to call route.
+
+    Ad-hoc endpoints are stored with a ``method`` of ``None``. The table is
+    built from every installed application's ``endpoints`` module and the
+    ``ModelEndpoint`` registry, either by ``AjaxConfig.ready()`` or on first
+    use, and rebuilt whenever the registry changes so that requests never
+    have to import or introspect anything.
+    """
+    # ModelEndpoint hooks that must never be exposed as a method.
+    hooks = ('authenticate', 'get_queryset')
+
+    def __init__(self):
+        self._routes = {}
+        self._applications = frozenset()
+        self._version = None
+
+    def autodiscover(self):
+        """Import every installed application's ``endpoints`` module."""
+        modules = {}
+        for label, module_name in get_app_modules():
+            if module_name == 'ajax':
+                continue  # ajax.endpoints is the framework itself.
+            try:
+                modules[label] = import_module('%s.endpoints' % module_name)
+            except ImportError:
+                if module_has_submodule(import_module(module_name),
+                    'endpoints'):
+                    raise
+        return modules
+
+    def build(self):
+        routes = {}
+        modules = self.autodiscover()
+        for application, module in modules.items():
+            for name, func in _adhoc_endpoints(module):
+                routes[(application, name, None)] = AdHocRoute(func)
+
+        registry = ajax.endpoint
+        for (application, name), model in registry._index.items():
+            endpoint_class = registry._registry[model]
+            for method in self.methods(endpoint_class):
+                routes[(application, name, method)] = ModelRoute(
+                    endpoint_class, model, method)
+
+        self._routes = routes
+        self._applications = frozenset(modules) | frozenset(
+            application for application, name in registry._index)
+        self._version = registry.version
+
+    def methods(self, endpoint_class):
+        """Return the names of the routable methods of ``endpoint_class``."""
+        for name in dir(endpoint_class):
+            if name.startswith(('_', 'can_')) or name in self.hooks:
+                continue
+            if inspect.isroutine(getattr(endpoint_class, name, None)):
+                yield name
+
+    def routes(self):
+        if self._version != ajax.endpoint.version:
+            self.build()
+        return self._routes
+
+    def resolve(self, application, name, method):
+        """Return the route for the request or raise an ``AJAXError``."""
+        routes = self.routes()
+        route = routes.get((application, name, None))
+        if route is None:
+            route = routes.get((application, name, method))
+
+        if route is None:
+            if application not in self._applications:
+                raise AJAXError(404, _('AJAX endpoint does not exist.'))
+            elif ajax.endpoint.is_registered(name, application):
+                raise AJAXError(404, _('Invalid method.'))
+            raise AJAXError(500, _('Invalid model.'))
+
+        return route
+
+
+table = DispatchTable()
@@ -1,12 +1,14 @@
 from __future__ import absolute_import
-from django.core import serializers
+from ajax.compat import prefetch_related_objects
 from ajax.exceptions import AlreadyRegistered, NotRegistered
+from ajax.metrics import timed
 from django.db.models.fields import FieldDoesNotExist
 from django.db import models
+from django.db.models import signals
 from django.conf import settings
 from django.utils.html import escape
 from django.db.models.query import QuerySet
-from django.utils.encoding import smart_str
+from django.utils.encoding import force_text, is_protected_type
 import collections
 import six
 
@@ -19,6 +21,133 @@ def _fields_from_model(model):
     return [field.name for field in model.__class__._meta.fields]
 
 
+def _model_of(record):
+    """Return the model of ``record``, seeing through deferred classes.
+
+    Older versions of Django load ``only()``/``defer()`` querysets into
+    dynamically created subclasses of the model.
+    """
+    model = record.__class__
+    if getattr(record, '_deferred', False):
+        model = model._meta.proxy_for_model
+    return model
+
+
+def _identity(value):
+    return value
+
+
+def _to_bool(value):
+    # If someone could explain to me why the fuck the Python serializer
+    # appears to serialize BooleanField to a string with "True" or "False" in
+    # it, please let me know.
+    return (value == "True" or (type(value) == bool and value))
+
+
+class EncodingPlan(object):
+    """Precomputed recipe for encoding instances of a single model.
+
+    ``columns`` holds one ``(attname, key, converter)`` entry for every field
+    Django's Python serializer would visit for the given ``fields``, so that
+    ``DefaultEncoder.to_dict`` can read values straight off the record rather
+    than running each row through ``serializers.serialize()``. Plans are built
+    once and cached by ``Encoders.get_plan``.
+    """
+    def __init__(self, encoder, model, fields=None, html_escape=False):
+        self.model = model
+        self.html_escape = html_escape
+        self.escape = encoder._escaper(html_escape)
+
+        columns = []
+        foreign_keys = []
+        # Use the concrete model just like the serializer does for proxies.
+        opts = model._meta.concrete_model._meta
+        for field in opts.local_fields:
+            if not field.serialize:
+                continue
+            if fields is not None and field.name not in fields:
+                continue
+            columns.append((field.attname, field.name,
+                encoder._field_converter(field, html_escape)))
+            if isinstance(field, models.ForeignKey):
+                foreign_keys.append((field.attname, field.name, field.rel.to))
+
+        for field in opts.many_to_many:
+            if not field.serialize or not field.rel.through._meta.auto_created:
+                continue
+            if fields is not None and field.attname not in fields:
+                continue
+            columns.append((field.attname, field.name,
+                encoder._m2m_converter(field, html_escape)))
+
+        self.columns = tuple(columns)
+        self.foreign_keys = tuple(foreign_keys)
+        self.keys = frozenset(key for attname, key, converter in columns)
+        self._loose = {}
+
+    def loose_field(self, encoder, name):
+        """Resolve a key that didn't come from ``columns``.
+
+        This covers ``AJAX_PK_ATTR_NAME`` and anything in ``extra_fields``.
+        Returns a ``(field, converter)`` tuple or ``None`` if ``name`` isn't a
+        field on the model.
+        """
+        try:
+            return self._loose[name]
+        except KeyError:
+            try:
+                field = self.model._meta.get_field(name)
+                entry = (field, encoder._value_converter(field,
+                    self.html_escape))
+            except FieldDoesNotExist:
+                entry = None
+            self._loose[name] = entry
+            return entry
+
+
+class ValuesPlan(object):
+    """Encodes ``values_list()`` rows exactly like ``DefaultEncoder``.
+
+    ``attnames`` are the columns to select; calling the plan with a row
+    returns the dict ``to_dict`` would have built from the model instance.
+    Built by ``Encoders.get_values_plan``.
+    """
+    def __init__(self, encoder, plan):
+        self.columns = plan.columns
+        attnames = [attname for attname, key, converter in plan.columns]
+        pk = plan.model._meta.pk.attname
+        if pk not in attnames:
+            attnames.append(pk)
+        self.attnames = tuple(attnames)
+        self.pk_index = attnames.index(pk)
+
+        self.pk_converter = None
+        if AJAX_PK_ATTR_NAME not in plan.keys:
+            entry = plan.loose_field(encoder, AJAX_PK_ATTR_NAME)
+            if entry is not None:
+                self.pk_converter = entry[1]
+
+    def __call__(self, values):
+        # Converters read values off the record with value_to_string(), so
+        # give them a bare object holding the row instead of an instance.
+        row = _ValuesRow()
+        row.__dict__.update(zip(self.attnames, values))
+
+        ret = {}
+        for (attname, key, converter), value in zip(self.columns, values):
+            ret[key] = converter(row, value)
+
+        pk = force_text(values[self.pk_index], strings_only=True)
+        if self.pk_converter is not None:
+            pk = self.pk_converter(pk)
+        ret[AJAX_PK_ATTR_NAME] = pk
+        return ret
+
+
+class _ValuesRow(object):
+    pass
+
+
 class DefaultEncoder(object):
     _mapping = {
         'IntegerField': int,
@@ -27,7 +156,14 @@ class DefaultEncoder(object):
         'FloatField': float,
     }
 
-    def to_dict(self, record, expand=False, html_escape=False, fields=None):
+    def to_dict(self, record, expand=False, html_escape=False, fields=None,
+        related=None):
+        """Encode ``record`` into a dict.
+
+        ``related`` is the ``{model: {pk: instance}}`` mapping built by
+        ``Encoders.resolve_related`` when a whole batch is being expanded.
+        ForeignKeys found in it are used as-is instead of being fetched.
+        """
         self.html_escape = html_escape
         if hasattr(record, '__exclude__') and callable(record.__exclude__):
             try:
@@ -37,59 +173,118 @@ class DefaultEncoder(object):
                 fields = set(fields) - set(exclude)
             except TypeError:
                 pass
-        data = serializers.serialize('python', [record], fields=fields)[0]
+        plan = encoder.get_plan(self, record.__class__, fields, html_escape)
 
         if hasattr(record, 'extra_fields'):
             ret = record.extra_fields
         else:
             ret = {}
 
-        ret.update(data['fields'])
-        ret[AJAX_PK_ATTR_NAME] = data['pk']
+        for attname, key, converter in plan.columns:
+            ret[key] = converter(record, getattr(record, attname))
+        ret[AJAX_PK_ATTR_NAME] = force_text(record._get_pk_val(),
+            strings_only=True)
+
+        for key in [k for k in ret if k not in plan.keys]:
+            entry = plan.loose_field(self, key)
+            if entry is None:
+                continue  # Assume extra fields are already safe.
+
+            f, converter = entry
+            if expand and isinstance(f, models.ForeignKey):
+                ret[key] = self._expand(f.rel.to, ret[key], related)
+            else:
+                ret[key] = converter(ret[key])
+
+        if expand:
+            for attname, key, model in plan.foreign_keys:
+                ret[key] = self._expand(model, getattr(record, attname),
+                    related)
 
-        for field, val in six.iteritems(ret):
-            try:
-                f = record.__class__._meta.get_field(field)
-                if expand and isinstance(f, models.ForeignKey):
-                    try:
-                        row = f.rel.to.objects.get(pk=val)
-                        new_value = self.to_dict(row, False)
-                    except f.rel.to.DoesNotExist:
-                        new_value = None  # Changed this to None from {} -G
-                else:
-                    new_value = self._encode_value(f, val)
-
-                ret[smart_str(field)] = new_value
-            except FieldDoesNotExist as e:
-                pass  # Assume extra fields are already safe.
-                  
         if expand and hasattr(record, 'tags') and \
           record.tags.__class__.__name__.endswith('TaggableManager'):
           # Looks like this model is using taggit.
-          ret['tags'] = [{'name': self._escape(t.name), 
-          'slug': self._escape(t.slug)} for t in record.tags.all()]
-          
+          ret['tags'] = [{'name': plan.escape(t.name),
+          'slug': plan.escape(t.slug)} for t in record.tags.all()]
+
         return ret
 
     __call__ = to_dict
 
-    def _encode_value(self, field, value):
-        if value is None:
-            return value # Leave all None's as-is as they encode fine.
+    def _values_fields(self, model, fields=None):
+        """Return the fields ``__call__`` would encode for ``model``."""
+        return fields
+
+    def _expand(self, model, pk, related=None):
+        if pk is None:
+            return None
+
+        rows = related.get(model) if related else None
+        if rows is not None and pk in rows:
+            row = rows[pk]
+        else:
+            try:
+                row = model.objects.get(pk=pk)
+            except model.DoesNotExist:
+                row = None
+
+        if row is None:
+            return None  # Changed this to None from {} -G
 
+        return self.to_dict(row, False)
+
+    def _field_converter(self, field, html_escape=False):
+        """Return a ``converter(record, value)`` for a concrete field.
+
+        Values are normalized the same way the Python serializer does it
+        (protected types pass through, everything else goes through
+        ``value_to_string()``) before being encoded.
+        """
+        encode = self._value_converter(field, html_escape)
+
+        def convert(record, value):
+            if not is_protected_type(value):
+                value = field.value_to_string(record)
+            return encode(value)
+
+        return convert
+
+    def _m2m_converter(self, field, html_escape=False):
+        encode = self._value_converter(field, html_escape)
+
+        def convert(record, manager):
+            return encode([force_text(related._get_pk_val(), strings_only=True)
+                for related in manager.iterator()])
+
+        return convert
+
+    def _value_converter(self, field, html_escape=False):
+        """Return a ``converter(value)`` that encodes values of ``field``."""
         try:
-            return self._mapping[field.__class__.__name__](value)
+            cast = self._mapping[field.__class__.__name__]
         except KeyError:
             if isinstance(field, models.ForeignKey):
                 f = field.rel.to._meta.get_field(field.rel.field_name)
-                return self._encode_value(f, value)
+                return self._value_converter(f, html_escape)
             elif isinstance(field, models.BooleanField):
-                # If someone could explain to me why the fuck the Python
-                # serializer appears to serialize BooleanField to a string
-                # with "True" or "False" in it, please let me know.
-                return (value == "True" or (type(value) == bool and value))
+                cast = _to_bool
+            else:
+                cast = self._escaper(html_escape)
 
-        return self._escape(value)
+        def convert(value):
+            if value is None:
+                return value # Leave all None's as-is as they encode fine.
+            return cast(value)
+
+        return convert
+
+    def _encode_value(self, field, value):
+        return self._value_converter(field, self.html_escape)(value)
+
+    def _escaper(self, html_escape):
+        if html_escape:
+            return escape
+        return _identity
 
     def _escape(self, value):
         if self.html_escape:
@@ -99,6 +294,9 @@ class DefaultEncoder(object):
 
 class HTMLEscapeEncoder(DefaultEncoder):
     """Encodes all values using Django's HTML escape function."""
+    def _escaper(self, html_escape):
+        return escape
+
     def _escape(self, value):
         return escape(value)
 
@@ -107,22 +305,45 @@ class ExcludeEncoder(DefaultEncoder):
     def __init__(self, exclude):
         self.exclude = exclude
 
-    def __call__(self, record, html_escape=False):
-        fields = set(_fields_from_model(record)) - set(self.exclude)
-        return self.to_dict(record, html_escape=html_escape, fields=fields)
+    def __call__(self, record, html_escape=False, fields=None, **kwargs):
+        if fields is None:
+            fields = _fields_from_model(record)
+        fields = set(fields) - set(self.exclude)
+        return self.to_dict(record, html_escape=html_escape, fields=fields,
+            **kwargs)
+
+    def _values_fields(self, model, fields=None):
+        if fields is None:
+            fields = [field.name for field in model._meta.fields]
+        return set(fields) - set(self.exclude)
 
 
 class IncludeEncoder(DefaultEncoder):
     def __init__(self, include):
         self.include = include
 
-    def __call__(self, record, html_escape=False):
-        return self.to_dict(record, html_escape=html_escape, fields=self.include)
+    def __call__(self, record, html_escape=False, fields=None, **kwargs):
+        include = self.include
+        if fields is not None:
+            include = set(include) & set(fields)
+        return self.to_dict(record, html_escape=html_escape,
+            fields=include, **kwargs)
+
+    def _values_fields(self, model, fields=None):
+        if fields is None:
+            return self.include
+        return set(self.include) & set(fields)
 
 
 class Encoders(object):
+    # Encoders whose output ValuesPlan knows how to reproduce.
+    values_encoders = (DefaultEncoder, HTMLEscapeEncoder, ExcludeEncoder,
+        IncludeEncoder)
+
     def __init__(self):
         self._registry = {}
+        self._plans = {}
+        self._values_plans = {}
 
     def register(self, model, encoder):
         if model in self._registry:
@@ -136,27 +357,160 @@ class Encoders(object):
 
         del self._registry[model]
     
+    def get_plan(self, encoder, model, fields=None, html_escape=False):
+        """Return the ``EncodingPlan`` for encoding ``model`` with ``encoder``.
+
+        Plans are compiled on first use and cached per encoder class, model,
+        field set and ``html_escape`` flag.
+        """
+        if fields is not None:
+            fields = frozenset(fields)
+
+        key = (encoder.__class__, model, fields, html_escape)
+        try:
+            return self._plans[key]
+        except KeyError:
+            plan = EncodingPlan(encoder, model, fields, html_escape)
+            self._plans[key] = plan
+            return plan
+
+    def get_values_plan(self, model, fields=None, html_escape=False):
+        """Return a ``ValuesPlan`` for ``model`` or ``None``.
+
+        ``None`` means rows of ``model`` can't be encoded without a model
+        instance: the model defines ``extra_fields`` or ``__exclude__``, has
+        ``post_init`` receivers (which could set ``extra_fields`` on
+        instances), has many-to-many fields to encode or is registered with
+        a custom encoder. ``extra_fields`` set on instances any other way,
+        e.g. in ``__init__``, can't be seen here.
+        """
+        encoder = self._registry.get(model) or DefaultEncoder()
+        if encoder.__class__ not in self.values_encoders or \
+            hasattr(model, 'extra_fields') or \
+            callable(getattr(model, '__exclude__', None)) or \
+            signals.post_init.has_listeners(model):
+            return None
+
+        fields = encoder._values_fields(model, fields)
+        if fields is not None:
+            fields = frozenset(fields)
+
+        key = (encoder.__class__, model, fields, html_escape)
+        try:
+            return self._values_plans[key]
+        except KeyError:
+            pass
+
+        plan = self.get_plan(encoder, model, fields, html_escape)
+        if any(field.attname in plan.keys
+            for field in model._meta.concrete_model._meta.many_to_many):
+            values_plan = None
+        else:
+            values_plan = ValuesPlan(encoder, plan)
+        self._values_plans[key] = values_plan
+        return values_plan
+
+    def supports_fields(self, model):
+        """Return whether records of ``model`` can be encoded with ``fields``.
+
+        Only ``DefaultEncoder`` and its subclasses take ``fields``; custom
+        encoders always encode their own set of fields.
+        """
+        return isinstance(self._registry.get(model, DefaultEncoder()),
+            DefaultEncoder)
+
     def get_encoder_from_record(self, record):
         if isinstance(record, models.Model) and \
-            record.__class__ in self._registry:
-            encoder = self._registry[record.__class__]
+            _model_of(record) in self._registry:
+            encoder = self._registry[_model_of(record)]
         else:
             encoder = DefaultEncoder()
         return encoder
         
-    def encode(self, record, encoder=None, html_escape=False):
-        if isinstance(record, collections.Iterable):
-            ret = []
-            for i in record:
+    def resolve_related(self, records):
+        """Fetch everything needed to expand ``records`` in a few queries.
+
+        Every ForeignKey value in the batch is collected and each related
+        model is loaded with a single ``in_bulk()``, unless the relation was
+        already loaded through ``select_related()``. Returns a
+        ``{model: {pk: instance}}`` dict where dangling keys map to ``None``.
+        Tags of taggit models are prefetched onto the records in one query.
+        """
+        by_model = {}
+        for record in records:
+            if isinstance(record, models.Model):
+                by_model.setdefault(record.__class__, []).append(record)
+
+        related = {}
+        wanted = {}
+        for model, instances in six.iteritems(by_model):
+            opts = model._meta.concrete_model._meta
+            for field in opts.local_fields:
+                if not field.serialize or \
+                    not isinstance(field, models.ForeignKey):
+                    continue
+
+                rows = related.setdefault(field.rel.to, {})
+                ids = wanted.setdefault(field.rel.to, set())
+                cache_name = field.get_cache_name()
+                for instance in instances:
+                    pk = getattr(instance, field.attname)
+                    if pk is None:
+                        continue
+                    if hasattr(instance, cache_name):
+                        rows[pk] = getattr(instance, cache_name)
+                    else:
+                        ids.add(pk)
+
+            instance = instances[0]
+            if hasattr(instance, 'tags') and \
+                instance.tags.__class__.__name__.endswith('TaggableManager'):
+                prefetch_related_objects(instances, 'tags')
+
+        for model, ids in six.iteritems(wanted):
+            ids.difference_update(related[model])
+            if ids:
+                rows = related[model]
+                rows.update(dict.fromkeys(ids))
+                rows.update(model.objects.in_bulk(list(ids)))
+
+        return related
+
+    def encode(self, record, encoder=None, html_escape=False, expand=False,
+        related=None, fields=None):
+        """Encode a record, or an iterable of records, into vanilla Python.
+
+        When ``expand`` is set ForeignKeys are replaced with the full related
+        record. For iterables and querysets the related rows of the whole
+        batch are resolved up front by ``resolve_related`` rather than with
+        one query per row. ``fields`` limits the encoded fields further than
+        the model's encoder already does and is ignored by encoders that
+        don't take it (see ``supports_fields``).
+        """
+        with timed('encode'):
+            if isinstance(record, collections.Iterable):
+                if expand and related is None:
+                    record = list(record)
+                    related = self.resolve_related(record)
+
+                ret = []
+                for i in record:
+                    if not encoder:
+                        encoder = self.get_encoder_from_record(i)
+                    ret.append(self.encode(i, html_escape=html_escape,
+                        expand=expand, related=related, fields=fields))
+            else:
                 if not encoder:
-                    encoder = self.get_encoder_from_record(i)
-                ret.append(self.encode(i, html_escape=html_escape))
-        else:
-            if not encoder:
-                encoder = self.get_encoder_from_record(record)
-            ret = encoder(record, html_escape=html_escape)
+                    encoder = self.get_encoder_from_record(record)
 
-        return ret
+                kwargs = {}
+                if expand:
+                    kwargs.update(expand=expand, related=related)
+                if fields is not None and isinstance(encoder, DefaultEncoder):
+                    kwargs['fields'] = fields
+                ret = encoder(record, html_escape=html_escape, **kwargs)
+
+            return ret
 
 
 encoder = Encoders()
@@ -1,17 +1,28 @@
 from __future__ import absolute_import
-from django.core.exceptions import ValidationError
+import base64
+import copy
+import hashlib
+
+from django.core.exceptions import ObjectDoesNotExist, ValidationError
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from django.db import models
-from django.utils.encoding import smart_str
+from django.db import connections, models, transaction
+from django.db.models import Q
+from django.db.models.query import QuerySet
+from django.utils.encoding import smart_bytes, smart_str
 from django.utils.translation import ugettext_lazy as _
 
-from ajax.compat import path_to_import
+from ajax.compat import (EmptyResultSet, get_cache, path_to_import,
+    queryset_iterator)
 from ajax.conf import settings
 from ajax.decorators import require_pk
 from ajax.exceptions import AJAXError, AlreadyRegistered, NotRegistered
 from ajax.encoders import encoder
+from ajax.metrics import timed
+from ajax.serializers import get_serializer
 from ajax.signals import ajax_created, ajax_deleted, ajax_updated
-from ajax.views import EnvelopedResponse
+from ajax.utils import ExpiringLRUCache, bump_version
+from ajax.views import (EnvelopedResponse, StreamingEnvelopedResponse,
+    etag_matches, make_etag, not_modified)
 import six
 
 try:
@@ -26,6 +37,104 @@ class EmptyPageResult(object):
         self.object_list = []
 
 
+_related_caches = {}  # model -> ExpiringLRUCache of rows by pk
+
+
+def related_cache(model, max_size=1000):
+    """Return the process-local cache of ``model`` rows used for ForeignKeys."""
+    try:
+        return _related_caches[model]
+    except KeyError:
+        return _related_caches.setdefault(model, ExpiringLRUCache(max_size))
+
+
+def _invalidate_related_cache(sender, instance, **kwargs):
+    cache = _related_caches.get(sender)
+    if cache is not None:
+        cache.delete(instance.pk)
+
+
+ajax_updated.connect(_invalidate_related_cache)
+ajax_deleted.connect(_invalidate_related_cache)
+
+
+def _version_key(kind, model):
+    return 'ajax.%s.%s.%s' % (kind, model._meta.app_label,
+        model.__name__.lower())
+
+
+def _record_cache_key(model, pk):
+    return 'ajax.get.%s.%s.%s' % (model._meta.app_label,
+        model.__name__.lower(), pk)
+
+
+def _invalidate_count_cache(sender, **kwargs):
+    from ajax import endpoint as registry
+    endpoint_class = registry._registry.get(sender)
+    if endpoint_class is None or endpoint_class.count_strategy != 'cached':
+        return
+
+    bump_version(get_cache(settings.AJAX_CACHE), _version_key('count', sender))
+
+
+def _invalidate_response_cache(sender, instance, **kwargs):
+    from ajax import endpoint as registry
+    endpoint_class = registry._registry.get(sender)
+    if endpoint_class is None or not endpoint_class.cache_responses:
+        return
+
+    cache = get_cache(settings.AJAX_CACHE)
+    cache.delete(_record_cache_key(sender, instance.pk))
+    bump_version(cache, _version_key('list', sender))
+
+
+ajax_created.connect(_invalidate_count_cache)
+ajax_deleted.connect(_invalidate_count_cache)
+ajax_created.connect(_invalidate_response_cache)
+ajax_updated.connect(_invalidate_response_cache)
+ajax_deleted.connect(_invalidate_response_cache)
+
+
+class EndpointMetadata(object):
+    """Model metadata a ``ModelEndpoint`` needs on every request.
+
+    Computed once per endpoint class and model and shared by every instance
+    through ``ModelEndpoint._get_metadata``.
+    """
+    def __init__(self, model, immutable_fields):
+        self.model = model
+        self.immutable_fields = frozenset(immutable_fields)
+        self.field_names = tuple(f.name for f in model._meta.fields)
+        self.fields = dict((f.name, f) for f in model._meta.fields)
+        self.foreign_keys = dict((f.name, f.rel.to)
+            for f in model._meta.fields if isinstance(f, models.ForeignKey))
+        self.coercers = dict((name, self._coercer(field))
+            for name, field in six.iteritems(self.fields)
+            if name not in self.immutable_fields)
+        # Fields that pre_save() changes on every save and therefore must
+        # always be part of update_fields.
+        self.auto_fields = tuple(f.name for f in model._meta.fields
+            if getattr(f, 'auto_now', False))
+
+    def _coercer(self, field):
+        """Return a callable turning a POSTed value into a ``field`` value.
+
+        ForeignKeys are coerced to the pk of the related row, which
+        ``ModelEndpoint._extract_data`` then swaps for the row itself.
+        """
+        if not isinstance(field, models.ForeignKey):
+            return field.to_python
+
+        pk_field = field.rel.to._meta.pk
+
+        def coerce(val):
+            if field.null and not val:
+                return None
+            return pk_field.to_python(val)
+
+        return coerce
+
+
 class ModelEndpoint(object):
     _value_map = {
         'false': False,
@@ -34,13 +143,51 @@ class ModelEndpoint(object):
     }
 
     immutable_fields = []  # List of model fields that are not writable.
+    partial_validation = False  # Only validate changed fields on update.
+    # Models whose rows are cached in-process when loaded for a ForeignKey,
+    # mapped to the number of seconds to keep them, e.g. ``{Category: 300}``.
+    foreign_key_cache = {}
+    foreign_key_cache_size = 1000
+    stream_list = False  # Stream ``list`` responses as they are encoded.
+    list_values = False  # Encode ``list`` pages straight from values_list().
+    select_related = []  # Relations ``list`` loads with ``select_related()``.
+    prefetch_related = []  # Lookups ``list`` loads with ``prefetch_related()``.
+    read_methods = ('get', 'list')  # Methods answering conditional requests.
+    allow_get = False  # Accept GET requests for ``read_methods``.
+    # Cache-Control directives and Vary headers of GET responses.
+    http_cache_control = {'private': True}
+    http_vary = ()
+    # Column (e.g. ``updated_at`` or a version) ``get`` builds its ETag from.
+    etag_field = None
+    # Cache ``get`` and ``list`` responses in the ``AJAX_CACHE`` cache.
+    cache_responses = False
+    cache_timeout = 300
+    cache_per_user = True  # Key ``list`` on the user, for get_queryset().
+    # Lookups ``list`` accepts per field, e.g. ``{'title': ['startswith']}``.
+    filter_fields = {}
+    order_fields = []  # Fields ``list`` may be ordered by with ``order_by``.
+    # Fields clients may limit ``get`` and ``list`` to with ``fields``.
+    sparse_fields = []
+    # How ``list`` counts the total: 'exact', 'cached', 'estimated' or None.
+    count_strategy = 'exact'
+    count_cache_timeout = 60
+    # Page ``list`` with cursors on these columns, e.g. ``['-created']``.
+    cursor_ordering = []
+    bulk_chunk_size = 500  # Rows per query written by the ``bulk_*`` methods.
+    # Most queries and bytes of peak memory each method may use, e.g.
+    # ``{'get': 1, 'list': 2}``. Checked by ``ajax.testing``.
+    query_budgets = {}
+    memory_budgets = {}
 
     authentication = path_to_import(settings.AJAX_AUTHENTICATION)()
 
+    _metadata = {}  # (endpoint class, model) -> EndpointMetadata
+
     def __init__(self, application, model, method, **kwargs):
         self.application = application
         self.model = model
-        self.fields = [f.name for f in self.model._meta.fields]
+        self.metadata = self._get_metadata()
+        self.fields = self.metadata.field_names
         self.method = method
         self.pk = kwargs.get('pk', None)
         self.options = kwargs
@@ -90,65 +237,449 @@ class ModelEndpoint(object):
             params = {"items_per_page":10,"page":2} //all params are optional
             $.post("/ajax/{app}/{model}/list.json"),params)
 
-        """
+        Set ``cursor_ordering`` on the endpoint to page through the records
+        with opaque cursors rather than page numbers. The response's
+        ``next`` and ``prev`` are then cursors (or ``null``) to POST back as
+        ``cursor``, and every page costs the same, however deep it is.
 
-        max_items_per_page = getattr(self, 'max_per_page',
-                                      getattr(settings, 'AJAX_MAX_PER_PAGE', 100))
-        requested_items_per_page = request.POST.get("items_per_page", 20)
-        items_per_page = min(max_items_per_page, requested_items_per_page)
-        current_page = request.POST.get("current_page", 1)
+        Fields listed in ``filter_fields`` can be filtered on by POSTing
+        ``{field}`` or ``{field}__{lookup}``, e.g. ``title__startswith=Foo``
+        or ``category__in=1,2``. ``order_by`` takes a comma separated list
+        of ``order_fields``, each optionally prefixed with ``-``.
+
+        Set ``list_values`` on the endpoint to read numbered pages with
+        ``values_list()`` and encode the rows without building model
+        instances. Models that need instances to be encoded are listed the
+        usual way.
+
+        Set ``stream_list`` on the endpoint to stream the page to the client
+        in chunks of ``stream_chunk_size`` (or ``AJAX_STREAM_CHUNK_SIZE``)
+        records rather than building the whole response in memory.
+        """
+        items_per_page = self._items_per_page(request)
+        fields = self._requested_fields(request)
 
         if not self.can_list(request.user):
             raise AJAXError(403, _("Access to this endpoint is forbidden"))
 
-        objects = self.get_queryset(request)
+        cache_key = None
+        if self.cache_responses and not self.stream_list:
+            cache = get_cache(settings.AJAX_CACHE)
+            cache_key = self._list_cache_key(request, fields, cache)
+            cached = cache.get(cache_key)
+            if cached is not None:
+                return EnvelopedResponse(data=cached[0], metadata=cached[1])
+
+        objects = self._filter_queryset(self.get_queryset(request), request)
+        if self.order_fields and not self.cursor_ordering:
+            objects = self._order_queryset(objects, request)
+        if self.select_related:
+            objects = objects.select_related(*self.select_related)
+        if self.prefetch_related:
+            objects = objects.prefetch_related(*self.prefetch_related)
+        if fields is not None:
+            objects = objects.only(*self._only_fields(fields))
+
+        if self.cursor_ordering:
+            records, metadata = self._cursor_page(objects,
+                request.POST.get('cursor'), items_per_page)
+        else:
+            records, metadata = self._numbered_page(objects,
+                request.POST.get("current_page", 1), items_per_page)
+
+        values_plan = None
+        if self.list_values and isinstance(records, QuerySet):
+            values_plan = encoder.get_values_plan(self.model, fields)
+        if values_plan is not None:
+            records = records.values_list(*values_plan.attnames)
+            encode = values_plan
+        else:
+            encode = lambda record: encoder.encode(record, fields=fields)
+
+        if self.stream_list:
+            chunk_size = getattr(self, 'stream_chunk_size',
+                                 getattr(settings, 'AJAX_STREAM_CHUNK_SIZE', 100))
+            if isinstance(records, QuerySet):
+                records = queryset_iterator(records, chunk_size)
+
+            data = (encode(record) for record in records)
+            return StreamingEnvelopedResponse(data=data, metadata=metadata,
+                chunk_size=chunk_size)
 
-        paginator = Paginator(objects, items_per_page)
+        with timed('encode'):
+            data = [encode(record) for record in records]
+        if cache_key is not None:
+            cache.set(cache_key, (data, metadata), self.cache_timeout)
+        return EnvelopedResponse(data=data, metadata=metadata)
+
+    def _list_cache_key(self, request, fields, cache):
+        """Key ``list`` responses on the request's normalized parameters.
+
+        Keys embed the model's list version, which every create, update and
+        delete bumps, so all cached pages are dropped at once.
+        """
+        if hasattr(request.POST, 'lists'):
+            params = request.POST.lists()
+        else:
+            params = six.iteritems(request.POST)
+        params = sorted((key, value) for key, value in params
+            if key != 'csrfmiddlewaretoken')
+
+        user = None
+        if self.cache_per_user:
+            user = getattr(request.user, 'pk', None)
+
+        version = cache.get(_version_key('list', self.model), 0)
+        digest = hashlib.md5(smart_bytes(repr((params, user,
+            self._cache_variant(fields))))).hexdigest()
+        return 'ajax.list.%s.%s.%s.%s' % (self.model._meta.app_label,
+            self.model.__name__.lower(), version, digest)
+
+    def _filter_queryset(self, objects, request):
+        """Apply the ``filter_fields`` lookups found in the request."""
+        filters = {}
+        for name, lookups in six.iteritems(self.filter_fields):
+            for lookup in lookups:
+                key = name if lookup == 'exact' else '%s__%s' % (name, lookup)
+                if key not in request.POST:
+                    continue
+                filters[key] = self._lookup_value(name, lookup,
+                    request.POST[key])
+
+        if filters:
+            objects = objects.filter(**filters)
+        return objects
+
+    def _lookup_value(self, name, lookup, value):
+        """Coerce a filter ``value`` with the field's ``to_python``.
+
+        ``in`` and ``range`` take comma separated values.
+        """
+        field = self.metadata.fields[name]
+        if isinstance(field, models.ForeignKey):
+            field = field.rel.to._meta.pk
 
         try:
-            page = paginator.page(current_page)
-        except PageNotAnInteger:
-            # If page is not an integer, deliver first page.
-            page = paginator.page(1)
-        except EmptyPage:
-            # If page is out of range (e.g. 9999), return empty list.
-            page = EmptyPageResult()
+            if lookup in ('in', 'range'):
+                values = [field.to_python(self._extract_value(v.strip()))
+                    for v in smart_str(value).split(',')]
+                if lookup == 'range' and len(values) != 2:
+                    raise ValidationError(value)
+                return values
+            return field.to_python(self._extract_value(value))
+        except ValidationError:
+            raise AJAXError(400, _('Invalid value for %s.') % name)
+
+    def _order_queryset(self, objects, request):
+        """Order by the ``order_fields`` given in ``order_by``.
+
+        The primary key is added last so pages don't shift between requests.
+        """
+        requested = request.POST.get('order_by')
+        if not requested:
+            return objects
+
+        ordering = [name.strip() for name in smart_str(requested).split(',')
+            if name.strip()]
+        invalid = set(name.lstrip('-') for name in ordering).difference(
+            self.order_fields)
+        if invalid:
+            raise AJAXError(400, _('Invalid ordering: %s.') %
+                ', '.join(sorted(invalid)))
+        return objects.order_by(*(ordering + ['pk']))
+
+    def _requested_fields(self, request):
+        """Return the ``fields`` asked for by the request or ``None``.
+
+        ``fields`` is a comma separated list of names taken from
+        ``sparse_fields``; it is ignored on endpoints that don't declare any.
+        Models registered with a custom encoder can't be encoded with
+        ``fields``, so the request is rejected.
+        """
+        requested = request.POST.get('fields')
+        if not requested or not self.sparse_fields:
+            return None
+        if not encoder.supports_fields(self.model):
+            raise AJAXError(400, _('The fields parameter is not supported '
+                'by this endpoint.'))
+
+        fields = [f.strip() for f in smart_str(requested).split(',')
+            if f.strip()]
+        invalid = set(fields).difference(self.sparse_fields)
+        if invalid:
+            raise AJAXError(400, _('Invalid fields: %s.') %
+                ', '.join(sorted(invalid)))
+        return fields
+
+    def _only_fields(self, fields):
+        """Return what to pass to ``only()`` when encoding just ``fields``.
+
+        Relations followed with ``select_related`` and the cursor ordering
+        columns can't be deferred, so they are loaded as well.
+        """
+        only = set(fields)
+        only.update(name.split('__')[0] for name in self.select_related)
+        if self.cursor_ordering:
+            only.update(name for name, field, descending
+                in self._cursor_fields() if name != 'pk')
+        return sorted(only)
+
+    def _items_per_page(self, request):
+        """Return the requested page size clamped to ``max_per_page``."""
+        max_items_per_page = getattr(self, 'max_per_page',
+                                      getattr(settings, 'AJAX_MAX_PER_PAGE', 100))
+        try:
+            items_per_page = int(request.POST.get("items_per_page", 20))
+        except (TypeError, ValueError):
+            items_per_page = 20
+        return max(1, min(max_items_per_page, items_per_page))
 
-        data = [encoder.encode(record) for record in page.object_list]
-        return EnvelopedResponse(data=data, metadata={'total': paginator.count})
+    def _numbered_page(self, objects, current_page, items_per_page):
+        if self.count_strategy == 'exact':
+            paginator = Paginator(objects, items_per_page)
 
+            try:
+                page = paginator.page(current_page)
+            except PageNotAnInteger:
+                # If page is not an integer, deliver first page.
+                page = paginator.page(1)
+            except EmptyPage:
+                # If page is out of range (e.g. 9999), return empty list.
+                page = EmptyPageResult()
+
+            return page.object_list, {'total': paginator.count,
+                'total_exact': True}
+
+        # Slice without a Paginator, which would need an exact count to
+        # validate the page number.
+        metadata = {}
+        total = None
+        if self.count_strategy is not None:
+            total, exact = self._count(objects)
+            metadata = {'total': total, 'total_exact': exact}
+            if not exact:
+                # Estimated or cached totals could hide pages that exist.
+                total = None
+
+        try:
+            number = int(current_page)
+        except (TypeError, ValueError):
+            number = 1
+        bottom = (number - 1) * items_per_page
+        if number < 1 or (total is not None and number > 1 and
+            bottom >= total):
+            # Out of range, which needs no query when the total is known.
+            records = []
+        else:
+            records = objects[bottom:bottom + items_per_page]
+        return records, metadata
+
+    def _count(self, objects):
+        """Return ``(total, exact)`` for ``objects`` per ``count_strategy``.
+
+        ``'cached'`` counts are kept in the ``AJAX_CACHE`` cache for
+        ``count_cache_timeout`` seconds under a key made from the queryset's
+        SQL, and are dropped whenever a record is created or deleted through
+        an endpoint. ``'estimated'`` counts come from the query planner on
+        PostgreSQL and are exact counts everywhere else.
+        """
+        try:
+            sql, params = objects.query.sql_with_params()
+        except EmptyResultSet:
+            return 0, True
+
+        if self.count_strategy == 'estimated':
+            estimate = self._estimate_count(objects, sql, params)
+            if estimate is not None:
+                return estimate, False
+            return objects.count(), True
+
+        cache = get_cache(settings.AJAX_CACHE)
+        version = cache.get(_version_key('count', self.model), 0)
+        key = 'ajax.count.%s.%s' % (version, hashlib.md5(smart_bytes(
+            repr((objects.db, sql, params)))).hexdigest())
+        total = cache.get(key)
+        if total is not None:
+            return total, False
+
+        total = objects.count()
+        cache.set(key, total, self.count_cache_timeout)
+        return total, True
+
+    def _estimate_count(self, objects, sql, params):
+        """Return the planner's row estimate for ``sql`` or ``None``."""
+        connection = connections[objects.db]
+        if connection.vendor != 'postgresql':
+            return None
+
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, six.string_types):
+            plan = get_serializer().loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+    def _cursor_page(self, objects, cursor, items_per_page):
+        """Return a page of ``objects`` after (or before) ``cursor``.
+
+        Records are ordered by ``cursor_ordering`` plus the primary key and
+        the page is selected with a ``WHERE`` on those columns rather than
+        an ``OFFSET``, so an index on them keeps every page equally cheap.
+        One extra record is fetched to find out whether there is another
+        page; no ``COUNT`` is made.
+        """
+        ordering = self._cursor_fields()
+        backwards = False
+        if cursor:
+            backwards, values = self._decode_cursor(ordering, cursor)
+            objects = objects.filter(
+                self._keyset_filter(ordering, values, backwards))
+
+        objects = objects.order_by(*[
+            ('-' if descending != backwards else '') + name
+            for name, field, descending in ordering])
+        records = list(objects[:items_per_page + 1])
+        more = len(records) > items_per_page
+        records = records[:items_per_page]
+        if backwards:
+            records.reverse()
+
+        # A page reached with a cursor always has a neighbour on the side it
+        # was reached from.
+        has_next = more if not backwards else True
+        has_prev = more if backwards else bool(cursor)
+        metadata = {
+            'next': self._encode_cursor(ordering, records[-1], False)
+                if records and has_next else None,
+            'prev': self._encode_cursor(ordering, records[0], True)
+                if records and has_prev else None,
+        }
+        return records, metadata
+
+    def _cursor_fields(self):
+        """Return ``(name, field, descending)`` for every ordering column.
+
+        The primary key is appended when missing so that the ordering is
+        unique, which keyset pagination requires.
+        """
+        opts = self.model._meta
+        ordering = []
+        for name in self.cursor_ordering:
+            descending = name.startswith('-')
+            name = name.lstrip('-')
+            field = opts.pk if name == 'pk' else opts.get_field(name)
+            ordering.append((name, field, descending))
+
+        if not any(field == opts.pk for name, field, descending in ordering):
+            ordering.append(('pk', opts.pk, False))
+        return ordering
+
+    def _keyset_filter(self, ordering, values, backwards):
+        """Build ``(a > x) | (a = x & b > y) | ...`` for ``ordering``."""
+        query = None
+        equal = {}
+        for (name, field, descending), value in zip(ordering, values):
+            lookup = 'lt' if descending != backwards else 'gt'
+            clause = Q(**dict(equal, **{'%s__%s' % (name, lookup): value}))
+            query = clause if query is None else query | clause
+            equal[name] = value
+        return query
+
+    def _encode_cursor(self, ordering, record, backwards):
+        values = [field.value_to_string(record)
+            for name, field, descending in ordering]
+        content = get_serializer().dumps([int(backwards), values])
+        return smart_str(base64.urlsafe_b64encode(content).rstrip(b'='))
+
+    def _decode_cursor(self, ordering, cursor):
+        try:
+            cursor = smart_bytes(cursor)
+            content = base64.urlsafe_b64decode(
+                cursor + b'=' * (-len(cursor) % 4))
+            backwards, values = get_serializer().loads(content)
+            if len(values) != len(ordering):
+                raise ValueError(cursor)
+            return bool(backwards), [field.to_python(value)
+                for (name, field, descending), value in zip(ordering, values)]
+        except (TypeError, ValueError, ValidationError):
+            raise AJAXError(400, _('Invalid cursor.'))
 
     def _set_tags(self, request, record):
         tags = self._extract_tags(request)
         if tags:
             record.tags.set(*tags)
 
-    def _save(self, record):
+    def _save(self, record, update_fields=None):
+        """Validate and save ``record``.
+
+        When ``update_fields`` is given only those columns are written and,
+        if ``partial_validation`` is set, only those fields are validated.
+        """
+        exclude = None
+        if update_fields is not None:
+            update_fields = list(update_fields) + [f for f in
+                self.metadata.auto_fields if f not in update_fields]
+            exclude = self._validation_exclude(update_fields)
+
+        self._validate(record, exclude=exclude)
+        record.save(update_fields=update_fields)
+        return record
+
+    def _validation_exclude(self, update_fields):
+        if not self.partial_validation:
+            return None
+        return [f for f in self.metadata.field_names if f not in update_fields]
+
+    def _validate(self, record, exclude=None):
         try:
-            record.full_clean()
-            record.save()
-            return record
+            record.full_clean(exclude=exclude)
         except ValidationError as e:
             raise AJAXError(400, _("Could not save model."),
                 errors=e.message_dict)
 
-    @require_pk
-    def update(self, request):
-        record = self._get_record()
-        modified = self._get_record()
+    def _copy_record(self, record):
+        """Return a shallow copy of ``record`` without hitting the database."""
+        copied = record.__class__.__new__(record.__class__)
+        copied.__dict__.update(record.__dict__)
+        copied._state = copy.copy(record._state)
+        return copied
+
+    def _apply_changes(self, record, data):
+        """Apply ``data`` to a copy of ``record``.
 
-        update_record = False
-        for key, val in six.iteritems(self._extract_data(request)):
+        Returns the copy and the names of the fields that actually changed.
+        """
+        modified = self._copy_record(record)
+        fields = self.metadata.fields
+        foreign_keys = self.metadata.foreign_keys
+
+        changed = []
+        for key, val in six.iteritems(data):
+            if key in foreign_keys:
+                # Compare ids so the current related row isn't fetched.
+                current = getattr(record, fields[key].attname)
+                new = val.pk if val is not None else None
+            else:
+                current = getattr(record, key)
+                new = val
 
             # Only setattr and save the model when a change has happened.
-            if val != getattr(record, key):
+            if new != current:
                 setattr(modified, key, val)
-                update_record = True
- 
+                changed.append(key)
+
+        return modified, changed
+
+    @require_pk
+    def update(self, request):
+        record = self._get_record()
+        modified, changed = self._apply_changes(record,
+            self._extract_data(request))
+
         if self.can_update(request.user, record, modified=modified):
- 
-            if update_record:
-                self._save(modified)
+
+            if changed:
+                self._save(modified, update_fields=changed)
 
             try:
                 tags = self._extract_tags(request)
@@ -179,12 +710,318 @@ class ModelEndpoint(object):
 
     @require_pk
     def get(self, request):
-        record = self._get_record()
-        if self.can_get(request.user, record):
-            return encoder.encode(record)
+        fields = self._requested_fields(request)
+        if self.etag_field and request.META.get('HTTP_IF_NONE_MATCH'):
+            # Answer revalidations from the ETag column alone.
+            record = self._get_record([self.etag_field])
+            if not self.can_get(request.user, record):
+                raise AJAXError(403, _("Access to endpoint is forbidden"))
+            etag = self._record_etag(record, fields)
+            if etag_matches(request, etag):
+                return not_modified(etag)
+
+        if self.cache_responses:
+            record, payload = self._cached_get(request, fields)
         else:
+            record = self._get_record(self._load_fields(fields))
+            if not self.can_get(request.user, record):
+                raise AJAXError(403, _("Access to endpoint is forbidden"))
+            payload = encoder.encode(record, fields=fields)
+
+        if self.etag_field:
+            return EnvelopedResponse(data=payload, metadata={},
+                etag=self._record_etag(record, fields))
+        return payload
+
+    def _load_fields(self, fields):
+        """Return the fields ``get`` loads to encode ``fields``."""
+        if fields is None or not self.etag_field:
+            return fields
+        return list(fields) + [self.etag_field]
+
+    def _record_etag(self, record, fields):
+        """Build the ETag of ``record`` from its ``etag_field``."""
+        value = self.metadata.fields[self.etag_field].value_to_string(record)
+        return make_etag(self.model._meta.app_label, self.model.__name__,
+            record.pk, self._cache_variant(fields), value)
+
+    def _cached_get(self, request, fields):
+        """``get`` served from the ``AJAX_CACHE`` cache.
+
+        The record is cached next to its encoded payloads, one per encoder
+        and set of ``fields``, so ``can_get`` is still asked about every
+        request without querying the database. Returns the record and the
+        payload.
+        """
+        try:
+            pk = self.model._meta.pk.to_python(self.pk)
+        except ValidationError:
+            raise AJAXError(400, _('Invalid request for record.'))
+
+        cache = get_cache(settings.AJAX_CACHE)
+        key = _record_cache_key(self.model, pk)
+        variant = self._cache_variant(fields)
+        record, payloads = cache.get(key) or (None, {})
+        if variant not in payloads:
+            record = self._get_record(self._load_fields(fields))
+
+        if not self.can_get(request.user, record):
             raise AJAXError(403, _("Access to endpoint is forbidden"))
 
+        if variant not in payloads:
+            payloads = dict(payloads)
+            payloads[variant] = encoder.encode(record, fields=fields)
+            cache.set(key, (record, payloads), self.cache_timeout)
+        return record, payloads[variant]
+
+    def _cache_variant(self, fields):
+        """Identify the encoder and ``fields`` a cached payload was built with."""
+        model_encoder = encoder._registry.get(self.model)
+        return '%s:%s' % (model_encoder.__class__.__name__
+            if model_encoder is not None else '',
+            ','.join(sorted(fields)) if fields is not None else '')
+
+    def bulk_create(self, request):
+        """Create several records in one request.
+
+        **Usage**::
+
+            params = {"records": '[{"title": "One"}, {"title": "Two"}]'}
+            $.post("/ajax/{app}/{model}/bulk_create.json", params)
+
+        Every record is validated and checked with ``can_create`` on its own.
+        ``data`` is a list with one ``{"success": ..., "data": ...}`` entry
+        per record, in order, holding either the new record or the error
+        that kept it from being saved. Valid records are inserted with
+        ``bulk_create()`` in batches of ``bulk_chunk_size``, so ``save()`` is
+        not called, tags are not supported and new pks are only returned by
+        databases that support it (e.g. PostgreSQL). The batches are
+        inserted in one transaction, so either all of them are saved or none.
+        """
+        results = []
+        created = []
+        with transaction.atomic():
+            for raw, data, error in self._bulk_data(request):
+                if error is None:
+                    try:
+                        record = self.model(**data)
+                        if not self.can_create(request.user, record):
+                            raise AJAXError(403,
+                                _("Access to endpoint is forbidden"))
+                        self._validate(record)
+                        created.append((len(results), record))
+                    except AJAXError as e:
+                        error = e
+                results.append(error.to_dict() if error is not None
+                    else None)
+
+            self.model.objects.bulk_create(
+                [record for index, record in created],
+                batch_size=self.bulk_chunk_size)
+
+        for index, record in created:
+            ajax_created.send(sender=record.__class__, instance=record)
+            results[index] = {'success': True, 'data': encoder.encode(record)}
+        return results
+
+    def bulk_update(self, request):
+        """Update several records in one request.
+
+        **Usage**::
+
+            params = {"records": '[{"pk": 1, "title": "One"}, {"pk": 2, "active": false}]'}
+            $.post("/ajax/{app}/{model}/bulk_update.json", params)
+
+        The records are fetched together and each one is checked with
+        ``can_update`` and validated on its own; results are reported per
+        record like ``bulk_create``. Records receiving the same changes are
+        written with a single ``QuerySet.update()`` per ``bulk_chunk_size``
+        rows, so ``save()`` is not called and tags are not supported.
+        """
+        items = []
+        pk_field = self.model._meta.pk
+        for raw, data, error in self._bulk_data(request):
+            pk = None
+            if error is None:
+                try:
+                    pk = pk_field.to_python(raw.get('pk'))
+                except ValidationError:
+                    pass
+                if pk is None:
+                    error = AJAXError(400, _('Invalid request for record.'))
+                # Never write the primary key itself.
+                data.pop(pk_field.name, None)
+            items.append((pk, data, error))
+
+        records = self._bulk_fetch([pk for pk, data, error in items
+            if error is None])
+
+        results = []
+        updated = []
+        for pk, data, error in items:
+            if error is None:
+                try:
+                    record = records.get(pk)
+                    if record is None:
+                        raise AJAXError(404, _('%s with id of "%s" not found.')
+                            % (self.model.__name__, pk))
+                    modified, changed = self._apply_changes(record, data)
+                    if not self.can_update(request.user, record,
+                        modified=modified):
+                        raise AJAXError(403,
+                            _("Access to endpoint is forbidden"))
+                    if changed:
+                        self._validate(modified,
+                            exclude=self._validation_exclude(changed))
+                    updated.append((len(results), record, modified, changed))
+                except AJAXError as e:
+                    error = e
+            results.append(error.to_dict() if error is not None else None)
+
+        with transaction.atomic():
+            self._bulk_write([(modified, changed)
+                for index, record, modified, changed in updated if changed])
+
+        for index, record, modified, changed in updated:
+            ajax_updated.send(sender=record.__class__, instance=record)
+            results[index] = {'success': True,
+                'data': encoder.encode(modified)}
+        return results
+
+    def bulk_delete(self, request):
+        """Delete several records in one request.
+
+        **Usage**::
+
+            params = {"pks": "[1, 2, 3]"}
+            $.post("/ajax/{app}/{model}/bulk_delete.json", params)
+
+        Each record is checked with ``can_delete``; results are reported per
+        record like ``bulk_create``. Rows are deleted with
+        ``QuerySet.delete()`` in batches of ``bulk_chunk_size``.
+        """
+        pks = []
+        pk_field = self.model._meta.pk
+        for raw in self._bulk_records(request, 'pks'):
+            try:
+                pks.append(pk_field.to_python(raw))
+            except ValidationError:
+                pks.append(None)
+
+        records = self._bulk_fetch([pk for pk in pks if pk is not None])
+
+        results = []
+        deleted = []
+        for pk in pks:
+            try:
+                if pk is None:
+                    raise AJAXError(400, _('Invalid request for record.'))
+                record = records.get(pk)
+                if record is None:
+                    raise AJAXError(404, _('%s with id of "%s" not found.') % (
+                        self.model.__name__, pk))
+                if not self.can_delete(request.user, record):
+                    raise AJAXError(403, _("Access to endpoint is forbidden"))
+                deleted.append((len(results), record))
+                results.append(None)
+            except AJAXError as e:
+                results.append(e.to_dict())
+
+        chunk = self.bulk_chunk_size
+        pks = [record.pk for index, record in deleted]
+        with transaction.atomic():
+            for start in range(0, len(pks), chunk):
+                self.model.objects.filter(
+                    pk__in=pks[start:start + chunk]).delete()
+
+        for index, record in deleted:
+            payload = {'pk': record.pk}
+            ajax_deleted.send(sender=record.__class__, instance=record,
+                payload=payload)
+            results[index] = {'success': True, 'data': payload}
+        return results
+
+    def _bulk_records(self, request, key='records'):
+        """Return the JSON encoded list POSTed as ``key``."""
+        try:
+            items = get_serializer().loads(request.POST[key])
+        except (KeyError, ValueError):
+            items = None
+
+        if not isinstance(items, list):
+            raise AJAXError(400, _('Invalid or missing %s.') % key)
+        return items
+
+    def _bulk_data(self, request):
+        """Yield ``(raw, data, error)`` for every record of a bulk request.
+
+        ``data`` is what ``_extract_data`` would return for the record on its
+        own, but ForeignKeys are resolved for all of the records at once.
+        ``error`` is an ``AJAXError`` when the record can't be used.
+        """
+        items = []
+        pending = {}
+        for raw in self._bulk_records(request):
+            if not isinstance(raw, dict):
+                items.append((raw, None, AJAXError(400, _('Invalid record.'))))
+                continue
+            try:
+                data, pending = self._coerce_data(raw, pending)
+                items.append((raw, data, None))
+            except ValidationError as e:
+                items.append((raw, None, AJAXError(400, _('Invalid record.'),
+                    errors=e.messages)))
+
+        rows = self._resolve_foreign_keys(pending) if pending else {}
+        for raw, data, error in items:
+            if error is None and rows:
+                try:
+                    self._swap_foreign_keys(data, rows)
+                except ObjectDoesNotExist as e:
+                    data, error = None, AJAXError(400, smart_str(e))
+            yield raw, data, error
+
+    def _bulk_fetch(self, pks):
+        """Return ``{pk: record}`` for ``pks``, ``bulk_chunk_size`` at a time."""
+        records = {}
+        chunk = self.bulk_chunk_size
+        for start in range(0, len(pks), chunk):
+            records.update(self.model.objects.in_bulk(pks[start:start + chunk]))
+        return records
+
+    def _bulk_write(self, updates):
+        """Write ``(record, changed)`` pairs with as few queries as possible.
+
+        Records sharing the exact same changes are written together with
+        ``QuerySet.update()``; ``auto_now`` fields get one shared timestamp.
+        """
+        if not updates:
+            return
+
+        fields = self.metadata.fields
+        auto = [(name, fields[name].pre_save(updates[0][0], False))
+            for name in self.metadata.auto_fields]
+
+        groups = {}
+        for record, changed in updates:
+            for name, value in auto:
+                setattr(record, name, value)
+
+            changes = tuple((key, getattr(record, key)) for key in
+                sorted(changed) if key not in self.metadata.auto_fields)
+            changes += tuple(auto)
+            try:
+                groups.setdefault(changes, []).append(record.pk)
+            except TypeError:
+                # Unhashable values can't be grouped; save the row alone.
+                record.save(update_fields=[key for key, value in changes])
+
+        chunk = self.bulk_chunk_size
+        for changes, pks in six.iteritems(groups):
+            for start in range(0, len(pks), chunk):
+                self.model.objects.filter(
+                    pk__in=pks[start:start + chunk]).update(**dict(changes))
+
     def _extract_tags(self, request):
         # We let this throw a KeyError so that calling functions will know if
         # there were NO tags in the request or if there were, but that the
@@ -209,40 +1046,114 @@ class ModelEndpoint(object):
         Django's ``User`` class, assume the value is an appropriate pk, and
         load up that record.
         """
+        data, pending = self._coerce_data(request.POST)
+        if pending:
+            self._swap_foreign_keys(data, self._resolve_foreign_keys(pending))
+        return data
+
+    def _coerce_data(self, values, pending=None):
+        """Coerce the raw ``values`` of a request to model field values.
+
+        ForeignKeys are left as pks and collected in ``pending``, a dict of
+        ``{model: set(pks)}``, so that several records can share the queries
+        made by ``_resolve_foreign_keys``. Returns ``(data, pending)``.
+        """
         data = {}
-        for field, val in six.iteritems(request.POST):
-            if field in self.immutable_fields:
-                continue  # Ignore immutable fields silently.
-
-            if field in self.fields:
-                field_obj = self.model._meta.get_field(field)
-                val = self._extract_value(val)
-                if isinstance(field_obj, models.ForeignKey):
-                    if field_obj.null and not val:
-                        clean_value = None
-                    else:
-                        clean_value = field_obj.rel.to.objects.get(pk=val)
-                else:
-                    clean_value = field_obj.to_python(val)
-                data[smart_str(field)] = clean_value
+        if pending is None:
+            pending = {}
+        coercers = self.metadata.coercers
+        foreign_keys = self.metadata.foreign_keys
+        for field, val in six.iteritems(values):
+            # Immutable fields have no coercer and are ignored silently.
+            coerce = coercers.get(field)
+            if coerce is None:
+                continue
+
+            value = coerce(self._extract_value(val))
+            data[smart_str(field)] = value
+            if value is not None and field in foreign_keys:
+                pending.setdefault(foreign_keys[field], set()).add(value)
+
+        return data, pending
+
+    def _swap_foreign_keys(self, data, rows):
+        """Replace the ForeignKey pks in ``data`` with the resolved ``rows``."""
+        for field, related in six.iteritems(self.metadata.foreign_keys):
+            pk = data.get(smart_str(field))
+            if pk is None:
+                continue
+            try:
+                data[smart_str(field)] = rows[related][pk]
+            except KeyError:
+                raise related.DoesNotExist(
+                    '%s matching query does not exist.' %
+                    related._meta.object_name)
 
-        return data
+    def _resolve_foreign_keys(self, pending):
+        """Load the rows for ``pending``, a dict of ``{model: set(pks)}``.
+
+        Every related model costs at most one query. Models listed in
+        ``foreign_key_cache`` are served from a process-local LRU cache
+        first; ``ajax_updated`` and ``ajax_deleted`` evict stale rows.
+        """
+        resolved = {}
+        for model, pks in six.iteritems(pending):
+            rows = {}
+            ttl = self.foreign_key_cache.get(model)
+            cache = None
+            if ttl:
+                cache = related_cache(model, self.foreign_key_cache_size)
+                for pk in pks:
+                    row = cache.get(pk)
+                    if row is not None:
+                        rows[pk] = row
+
+            missing = [pk for pk in pks if pk not in rows]
+            if missing:
+                fetched = model.objects.in_bulk(missing)
+                rows.update(fetched)
+                if cache is not None:
+                    for pk, row in six.iteritems(fetched):
+                        cache.set(pk, row, ttl)
+
+            resolved[model] = rows
+
+        return resolved
 
     def _extract_value(self, value):
         """If the value is true/false/null replace with Python equivalent."""
         return ModelEndpoint._value_map.get(smart_str(value).lower(), value)
 
-    def _get_record(self):
+    def _get_metadata(self):
+        """Return the ``EndpointMetadata`` shared by this endpoint class.
+
+        The cached copy is rebuilt if ``immutable_fields`` no longer matches
+        what it was built from.
+        """
+        key = (self.__class__, self.model)
+        metadata = ModelEndpoint._metadata.get(key)
+        if metadata is None or \
+            metadata.immutable_fields != frozenset(self.immutable_fields):
+            metadata = EndpointMetadata(self.model, self.immutable_fields)
+            ModelEndpoint._metadata[key] = metadata
+        return metadata
+
+    def _get_record(self, fields=None):
         """Fetch a given record.
 
         Handles fetching a record from the database along with throwing an
-        appropriate instance of ``AJAXError`.
+        appropriate instance of ``AJAXError`. Only ``fields`` are loaded when
+        given.
         """
         if not self.pk:
             raise AJAXError(400, _('Invalid request for record.'))
 
+        objects = self.model.objects
+        if fields is not None:
+            objects = objects.only(*fields)
+
         try:
-            return self.model.objects.get(pk=self.pk)
+            return objects.get(pk=self.pk)
         except self.model.DoesNotExist:
             raise AJAXError(404, _('%s with id of "%s" not found.') % (
                 self.model.__name__, self.pk))
@@ -300,23 +1211,45 @@ class FormEndpoint(object):
 class Endpoints(object):
     def __init__(self):
         self._registry = {}
+        self._index = {}  # (app_label, lowercase model name) -> model
+        self.version = 0  # Bumped on every change to the registry.
+
+    def _key(self, model):
+        return (model._meta.app_label, model.__name__.lower())
 
     def register(self, model, endpoint):
         if model in self._registry:
             raise AlreadyRegistered()
 
+        key = self._key(model)
+        if key in self._index:
+            raise AlreadyRegistered('%s.%s is already registered by %r.' % (
+                key + (self._index[key],)))
+
         self._registry[model] = endpoint
+        self._index[key] = model
+        self.version += 1
 
     def unregister(self, model):
         if model not in self._registry:
             raise NotRegistered()
 
         del self._registry[model]
+        del self._index[self._key(model)]
+        self.version += 1
+
+    def is_registered(self, model_name, application):
+        return (application, model_name) in self._index
 
     def load(self, model_name, application, method, **kwargs):
-        for model in self._registry:
-            if model.__name__.lower() == model_name:
-                return self._registry[model](application, model, method,
-                    **kwargs)
+        """Instantiate the endpoint registered for ``application.model_name``.
+
+        ``application`` is matched against the model's ``app_label`` so two
+        applications can each expose a model of the same name.
+        """
+        try:
+            model = self._index[(application, model_name)]
+        except KeyError:
+            raise NotRegistered()
 
-        raise NotRegistered()
+        return self._registry[model](application, model, method, **kwargs)
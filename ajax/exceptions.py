@@ -1,11 +1,12 @@
 from __future__ import absolute_import
-import json
 
 from django.utils.encoding import smart_str
 from django.http import HttpResponse, HttpResponseNotFound, \
     HttpResponseForbidden, HttpResponseNotAllowed, HttpResponseServerError, \
     HttpResponseBadRequest
 
+from ajax.serializers import get_serializer
+
 
 class AlreadyRegistered(Exception):
     pass
@@ -33,7 +34,7 @@ class AJAXError(Exception):
         self.msg = msg
         self.extra = kwargs  # Any kwargs will be appended to the output.
 
-    def get_response(self):
+    def to_dict(self):
         try:
             msg = smart_str(self.msg.decode())
         except (AttributeError,):
@@ -46,7 +47,9 @@ class AJAXError(Exception):
             }
         }
         error.update(self.extra)
+        return error
 
+    def get_response(self):
         response = self.RESPONSES[self.code]()
-        response.content = json.dumps(error, separators=(',', ':'))
+        response.content = get_serializer().dumps(self.to_dict())
         return response
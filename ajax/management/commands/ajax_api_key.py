@@ -0,0 +1,25 @@
+from __future__ import absolute_import
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from ajax.models import APIKey
+
+
+class Command(BaseCommand):
+    help = 'Creates an API key for a user and prints it.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('--name', default='',
+            help='What the key is used for.')
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        try:
+            user = User.objects.get_by_natural_key(options['username'])
+        except User.DoesNotExist:
+            raise CommandError('User "%s" does not exist.' %
+                options['username'])
+
+        api_key, key = APIKey.objects.create_key(user, options['name'])
+        self.stdout.write(key)
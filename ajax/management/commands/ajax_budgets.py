@@ -0,0 +1,49 @@
+from __future__ import absolute_import
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from ajax.testing import SWEEP_METHODS, sweep, synthetic_instance
+
+
+class Command(BaseCommand):
+    help = ('Calls every registered ModelEndpoint with synthetic rows in a '
+        'test database and reports the ones going over their query or '
+        'memory budgets or running more queries for bigger pages.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10,
+            help='Number of synthetic rows per model.')
+        parser.add_argument('--method', action='append',
+            choices=SWEEP_METHODS, help='Only call this method. Can be '
+                'given several times.')
+
+    def handle(self, *args, **options):
+        if options['rows'] < 1:
+            raise CommandError('--rows must be at least 1.')
+
+        old_name = connection.creation.create_test_db(verbosity=0,
+            autoclobber=True, serialize=False)
+        try:
+            # DEBUG would log every query.
+            with override_settings(DEBUG=False):
+                violations = sweep(self.user(), options['rows'],
+                    options['method'] or SWEEP_METHODS)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        for violation in violations:
+            self.stdout.write(str(violation))
+        if violations:
+            raise CommandError('Found %d budget violations.' %
+                len(violations))
+        self.stdout.write('Every endpoint is within budget.')
+
+    def user(self):
+        user = synthetic_instance(get_user_model(), 0)
+        for flag in ('is_active', 'is_staff', 'is_superuser'):
+            if hasattr(user, flag):
+                setattr(user, flag, True)
+        user.save()
+        return user
@@ -0,0 +1,18 @@
+from __future__ import absolute_import
+from django.core.management.base import BaseCommand
+
+from ajax.dispatch import table
+
+
+class Command(BaseCommand):
+    help = 'Lists every AJAX endpoint in the dispatch table.'
+
+    def handle(self, *args, **options):
+        routes = table.routes()
+        for key in sorted(routes, key=lambda k: (k[0], k[1], k[2] or '')):
+            application, name, method = key
+            if method is None:
+                url = '%s/%s.json' % (application, name)
+            else:
+                url = '%s/%s/%s.json' % (application, name, method)
+            self.stdout.write('%-50s %s' % (url, routes[key]))
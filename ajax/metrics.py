@@ -0,0 +1,349 @@
+"""Process-local performance metrics of AJAX endpoints.
+
+When ``AJAX_METRICS`` is on, every request to ``endpoint_loader`` is
+measured: its wall time, the number and time of its database queries, the
+time spent encoding records and serializing JSON, the size of the response
+and its status code. The measurements are aggregated per (application,
+model, method) into the histograms of ``registry`` and handed to the sinks
+listed in ``AJAX_METRICS_SINKS``.
+"""
+from __future__ import absolute_import
+import bisect
+import copy
+import functools
+import socket
+import threading
+from timeit import default_timer
+
+from django.db import connections
+from django.http import HttpResponse
+
+from ajax.compat import getLogger, path_to_import, track_queries
+from ajax.conf import settings
+from ajax.signals import ajax_request_finished
+
+
+logger = getLogger('django.request')
+
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+    2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# The histograms kept per endpoint: (name, description, buckets).
+HISTOGRAMS = (
+    ('request_seconds', 'Wall time of requests.', TIME_BUCKETS),
+    ('queries', 'Database queries per request.', QUERY_BUCKETS),
+    ('query_seconds', 'Time spent in database queries.', TIME_BUCKETS),
+    ('encode_seconds', 'Time spent encoding records.', TIME_BUCKETS),
+    ('serialize_seconds', 'Time spent serializing JSON.', TIME_BUCKETS),
+    ('response_bytes', 'Size of response bodies.', SIZE_BUCKETS),
+)
+
+_local = threading.local()
+
+
+class Sample(object):
+    """The measurements of a single request.
+
+    ``application``, ``model`` and ``method`` are empty when the request
+    didn't resolve to an endpoint. ``response_bytes`` is ``None`` for
+    streaming responses.
+    """
+    def __init__(self):
+        self.application = self.model = self.method = ''
+        self.status = None
+        self.request_seconds = None
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.encode_seconds = 0.0
+        self.serialize_seconds = 0.0
+        self.response_bytes = None
+        self._depth = {}
+
+    @property
+    def key(self):
+        return (self.application, self.model, self.method)
+
+    def add_query(self, seconds):
+        self.queries += 1
+        self.query_seconds += seconds
+
+
+class _Timer(object):
+    def __init__(self, sample, phase):
+        self.sample = sample
+        self.attr = phase + '_seconds'
+
+    def __enter__(self):
+        depth = self.sample._depth.get(self.attr, 0)
+        self.sample._depth[self.attr] = depth + 1
+        if not depth:
+            self.start = default_timer()
+
+    def __exit__(self, *exc_info):
+        depth = self.sample._depth[self.attr] - 1
+        self.sample._depth[self.attr] = depth
+        if not depth:
+            setattr(self.sample, self.attr, getattr(self.sample, self.attr) +
+                default_timer() - self.start)
+
+
+class _NotTimed(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_not_timed = _NotTimed()
+
+
+def timed(phase):
+    """Time the ``'encode'`` or ``'serialize'`` phase of the current request.
+
+    Nested timers of the same phase are only counted once. Does nothing
+    when the request isn't being measured.
+    """
+    sample = getattr(_local, 'sample', None)
+    if sample is None:
+        return _not_timed
+    return _Timer(sample, phase)
+
+
+def label(application, model, method):
+    """Name the endpoint the current request resolved to."""
+    sample = getattr(_local, 'sample', None)
+    if sample is not None:
+        sample.application = application
+        sample.model = model
+        sample.method = method
+
+
+class _QueryTracker(object):
+    """Track the queries of every database connection into ``sample``."""
+    def __init__(self, sample):
+        self.managers = [track_queries(connection, sample.add_query)
+            for connection in connections.all()]
+
+    def __enter__(self):
+        for manager in self.managers:
+            manager.__enter__()
+
+    def __exit__(self, *exc_info):
+        for manager in reversed(self.managers):
+            manager.__exit__(None, None, None)
+
+
+def instrumented(view):
+    """Measure every request to ``view`` while ``AJAX_METRICS`` is on."""
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not settings.AJAX_METRICS:
+            return view(request, *args, **kwargs)
+
+        sample = Sample()
+        previous = getattr(_local, 'sample', None)
+        _local.sample = sample
+        start = default_timer()
+        try:
+            with _QueryTracker(sample):
+                response = view(request, *args, **kwargs)
+        finally:
+            _local.sample = previous
+
+        sample.request_seconds = default_timer() - start
+        sample.status = response.status_code
+        if not getattr(response, 'streaming', False):
+            sample.response_bytes = len(response.content)
+        record(sample)
+        return response
+
+    return wrapper
+
+
+class Histogram(object):
+    """Counts observations into fixed buckets, like a Prometheus histogram."""
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """Return ``(upper bound, count)`` pairs, ending with infinity."""
+        total = 0
+        pairs = []
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+
+class EndpointStats(object):
+    """The histograms of one endpoint and its count of responses by status."""
+    def __init__(self):
+        for name, description, buckets in HISTOGRAMS:
+            setattr(self, name, Histogram(buckets))
+        self.responses = {}
+
+    def observe(self, sample):
+        for name, description, buckets in HISTOGRAMS:
+            value = getattr(sample, name)
+            if value is not None:
+                getattr(self, name).observe(value)
+        self.responses[sample.status] = \
+            self.responses.get(sample.status, 0) + 1
+
+
+def _labels(key):
+    values = [value.replace('\\', '\\\\').replace('"', '\\"').replace('\n',
+        '\\n') for value in key]
+    return 'application="%s",model="%s",method="%s"' % tuple(values)
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class MetricsRegistry(object):
+    """Aggregates the samples of this process per endpoint."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def observe(self, sample):
+        with self._lock:
+            stats = self._stats.get(sample.key)
+            if stats is None:
+                stats = self._stats[sample.key] = EndpointStats()
+            stats.observe(sample)
+
+    def get(self, application, model, method):
+        """Return a copy of the ``EndpointStats`` of an endpoint, or ``None``."""
+        with self._lock:
+            return copy.deepcopy(self._stats.get((application, model,
+                method)))
+
+    def snapshot(self):
+        """Return a sorted list of ``(key, EndpointStats)`` copies."""
+        with self._lock:
+            return sorted(copy.deepcopy(self._stats).items(),
+                key=lambda item: item[0])
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+    def prometheus(self):
+        """Render the metrics in the Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        lines = []
+        for name, description, buckets in HISTOGRAMS:
+            metric = 'ajax_' + name
+            lines.append('# HELP %s %s' % (metric, description))
+            lines.append('# TYPE %s histogram' % metric)
+            for key, stats in snapshot:
+                labels = _labels(key)
+                histogram = getattr(stats, name)
+                for bound, count in histogram.cumulative():
+                    lines.append('%s_bucket{%s,le="%s"} %d' % (metric, labels,
+                        _number(bound), count))
+                lines.append('%s_sum{%s} %s' % (metric, labels,
+                    _number(histogram.sum)))
+                lines.append('%s_count{%s} %d' % (metric, labels,
+                    histogram.count))
+
+        lines.append('# HELP ajax_responses_total Responses by status code.')
+        lines.append('# TYPE ajax_responses_total counter')
+        for key, stats in snapshot:
+            for status, count in sorted(stats.responses.items()):
+                lines.append('ajax_responses_total{%s,status="%s"} %d' % (
+                    _labels(key), status, count))
+
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+def prometheus_view(request):
+    """Expose ``registry`` to Prometheus.
+
+    This isn't part of ``ajax.urls``; add it to your own URLs behind
+    whatever keeps it internal.
+    """
+    return HttpResponse(registry.prometheus(),
+        content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class SignalSink(object):
+    """Sends ``ajax.signals.ajax_request_finished`` with every sample."""
+    def emit(self, sample):
+        ajax_request_finished.send(sender=Sample, sample=sample)
+
+
+class StatsdSink(object):
+    """Sends every sample to statsd over UDP.
+
+    Times are sent as timers in milliseconds, queries and response bytes as
+    histograms and the status code as a counter, all named
+    ``<prefix>.<application>.<model>.<method>.<metric>``.
+    """
+    def __init__(self):
+        self.address = (settings.AJAX_METRICS_STATSD_HOST,
+            settings.AJAX_METRICS_STATSD_PORT)
+        self.prefix = settings.AJAX_METRICS_STATSD_PREFIX
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def format(self, sample):
+        name = '.'.join([self.prefix] + [part or '_' for part in sample.key])
+        lines = []
+        for metric, description, buckets in HISTOGRAMS:
+            value = getattr(sample, metric)
+            if value is None:
+                continue
+            if metric.endswith('_seconds'):
+                lines.append('%s.%s:%.3f|ms' % (name,
+                    metric[:-len('_seconds')], value * 1000))
+            else:
+                lines.append('%s.%s:%d|h' % (name, metric, value))
+        lines.append('%s.status.%d:1|c' % (name, sample.status))
+        return '\n'.join(lines).encode('utf-8')
+
+    def emit(self, sample):
+        self.socket.sendto(self.format(sample), self.address)
+
+
+_sinks = (None, [])
+
+
+def get_sinks():
+    """Return instances of the sinks listed in ``AJAX_METRICS_SINKS``."""
+    global _sinks
+    names = tuple(settings.AJAX_METRICS_SINKS)
+    if _sinks[0] != names:
+        _sinks = (names, [path_to_import(name)() for name in names])
+    return _sinks[1]
+
+
+def record(sample):
+    """Add ``sample`` to ``registry`` and hand it to the sinks.
+
+    A failing sink is logged and never breaks the request.
+    """
+    registry.observe(sample)
+    for sink in get_sinks():
+        try:
+            sink.emit(sample)
+        except Exception:
+            logger.warning('AJAX metrics sink %r failed.', sink,
+                exc_info=True)
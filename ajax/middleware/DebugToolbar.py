@@ -1,13 +1,8 @@
 from __future__ import absolute_import
-import json
 
-from django.utils import six
 from debug_toolbar.middleware import DebugToolbarMiddleware, add_content_handler
-from django.core.serializers.json import DjangoJSONEncoder
 
-
-class AJAXDebugToolbarJSONEncoder(DjangoJSONEncoder):
-    pass
+from ajax.serializers import get_serializer
 
 
 class AJAXDebugToolbarMiddleware(DebugToolbarMiddleware):
@@ -20,18 +15,19 @@ class AJAXDebugToolbarMiddleware(DebugToolbarMiddleware):
     the django-debug-toolbar panels.
     """
     def _append_json(self, response, toolbar):
-        if isinstance(response.content, six.text_type):
-            payload = json.loads(response.content)
-        else:
-            payload = json.loads(response.content.decode('utf-8'))
+        if getattr(response, 'streaming', False):
+            return response  # The body isn't available to rewrite.
+
+        serializer = get_serializer()
+        payload = serializer.loads(response.content)
         payload['debug_toolbar'] = {
             'sql': toolbar.stats['sql'],
             'timer': toolbar.stats['timer']
         }
         try:
-            response.content = json.dumps(payload, indent=4,
-                cls=AJAXDebugToolbarJSONEncoder)
-        except:
+            response.content = serializer.dumps(payload, indent=4)
+        except (TypeError, ValueError):
+            # Toolbar stats the serializer can't encode; keep the response.
             pass
         return response
 
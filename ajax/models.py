@@ -0,0 +1,77 @@
+from __future__ import absolute_import
+import hashlib
+
+from django.conf import settings
+from django.db import models
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+from django.utils.encoding import python_2_unicode_compatible, smart_bytes
+
+from ajax.compat import get_cache
+from ajax.utils import bump_version
+
+
+API_KEYS_VERSION = 'ajax.api_keys.version'
+
+
+def hash_key(key):
+    """Return the digest API keys are stored and looked up by.
+
+    Keys are long and random, so a fast hash is as good as a slow one.
+    """
+    return hashlib.sha256(smart_bytes(key)).hexdigest()
+
+
+class APIKeyManager(models.Manager):
+    def create_key(self, user, name=''):
+        """Create a key for ``user`` and return ``(api_key, key)``.
+
+        ``key`` is what clients send. Only its hash is stored, so it can't
+        be recovered later.
+        """
+        key = '%s.%s' % (get_random_string(8), get_random_string(40))
+        api_key = self.create(user=user, name=name, prefix=key[:8],
+            hashed_key=hash_key(key))
+        return api_key, key
+
+
+@python_2_unicode_compatible
+class APIKey(models.Model):
+    """An API key ``ajax.authentication.APIKeyAuthentication`` accepts."""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL,
+        related_name='ajax_api_keys')
+    name = models.CharField(max_length=100, blank=True)
+    prefix = models.CharField(max_length=8)  # Tells keys apart.
+    hashed_key = models.CharField(max_length=64, unique=True)
+    is_active = models.BooleanField(default=True)
+    created = models.DateTimeField(auto_now_add=True)
+    expires = models.DateTimeField(null=True, blank=True)
+
+    objects = APIKeyManager()
+
+    class Meta:
+        verbose_name = 'API key'
+
+    def __str__(self):
+        return '%s (%s...)' % (self.name or self.user, self.prefix)
+
+    def is_valid(self):
+        return self.is_active and (self.expires is None or
+            self.expires > timezone.now())
+
+    def revoke(self):
+        self.is_active = False
+        self.save(update_fields=['is_active'])
+
+
+def _invalidate_api_keys(sender, created=False, **kwargs):
+    # Processes drop the keys they verified once the version changes.
+    if created:
+        return
+    from ajax.conf import settings as ajax_settings
+    bump_version(get_cache(ajax_settings.AJAX_CACHE), API_KEYS_VERSION)
+
+
+post_save.connect(_invalidate_api_keys, sender=APIKey)
+post_delete.connect(_invalidate_api_keys, sender=APIKey)
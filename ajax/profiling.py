@@ -0,0 +1,157 @@
+"""Opt-in profiling of requests made through ``json_response``.
+
+Nothing is profiled unless ``AJAX_PROFILE_DIR`` is set. Then a random
+``AJAX_PROFILE_RATE`` of requests, as well as requests from staff users that
+carry the ``AJAX_PROFILE_HEADER`` header, are profiled and the results are
+written to ``AJAX_PROFILE_DIR`` in a file named after the endpoint and the
+request id. Other requests only pay for a couple of settings lookups.
+"""
+from __future__ import absolute_import
+import collections
+import cProfile
+import errno
+import os
+import random
+import re
+import sys
+import threading
+import uuid
+
+from ajax.compat import getLogger
+from ajax.conf import settings
+
+
+logger = getLogger('django.request')
+
+
+class CProfiler(object):
+    """Deterministic profiling with cProfile, saved as pstats."""
+    extension = 'pstats'
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def save(self, path):
+        self.profile.dump_stats(path)
+
+
+class StackSampler(object):
+    """Samples the stack of the profiled thread every ``interval`` seconds.
+
+    Saves the samples as collapsed stacks, one ``frame;frame;frame count``
+    line per distinct stack, which flamegraph.pl and speedscope read. Being
+    wall-clock, time spent waiting on the database shows up too.
+    """
+    extension = 'collapsed'
+
+    def __init__(self, interval=None):
+        self.interval = interval or settings.AJAX_PROFILE_INTERVAL
+        self.stacks = collections.Counter()
+        self._stopped = threading.Event()
+
+    def start(self):
+        self._thread_id = threading.current_thread().ident
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is not None:
+                self.stacks[self._collapse(frame)] += 1
+
+    def _collapse(self, frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append('%s (%s:%d)' % (code.co_name, code.co_filename,
+                code.co_firstlineno))
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def save(self, path):
+        with open(path, 'w') as output:
+            for stack, count in sorted(self.stacks.items()):
+                output.write('%s %d\n' % (stack, count))
+
+
+PROFILERS = {
+    'cprofile': CProfiler,
+    'sampler': StackSampler,
+}
+
+
+def _header_key(header):
+    return 'HTTP_' + header.upper().replace('-', '_')
+
+
+def should_profile(request):
+    """Whether ``request`` is sampled or asked to be profiled."""
+    if not settings.AJAX_PROFILE_DIR:
+        return False
+
+    if settings.AJAX_PROFILE_RATE and \
+        random.random() < settings.AJAX_PROFILE_RATE:
+        return True
+
+    header = settings.AJAX_PROFILE_HEADER
+    if header and request.META.get(_header_key(header)):
+        user = getattr(request, 'user', None)
+        return bool(user is not None and user.is_staff)
+    return False
+
+
+def _request_id(request):
+    request_id = re.sub(r'[^\w-]', '',
+        request.META.get('HTTP_X_REQUEST_ID', ''))[:64]
+    return request_id or uuid.uuid4().hex
+
+
+def _endpoint_name(request):
+    path = request.path
+    if path.endswith('.json'):
+        path = path[:-len('.json')]
+    return re.sub(r'\W+', '.', path).strip('.') or 'root'
+
+
+def profile(request, func, *args, **kwargs):
+    """Return ``func(*args, **kwargs)``, profiling the call.
+
+    The response gets the request id the results are saved under in its
+    ``X-AJAX-Profile-Id`` header. Failing to save them is logged.
+    """
+    profiler = PROFILERS[settings.AJAX_PROFILER]()
+    profiler.start()
+    try:
+        response = func(*args, **kwargs)
+    finally:
+        profiler.stop()
+
+    request_id = _request_id(request)
+    path = os.path.join(settings.AJAX_PROFILE_DIR, '%s.%s.%s' % (
+        _endpoint_name(request), request_id, profiler.extension))
+    try:
+        try:
+            os.makedirs(settings.AJAX_PROFILE_DIR)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        profiler.save(path)
+    except (IOError, OSError):
+        logger.warning('Could not save the profile of %s to %s.',
+            request.path, path, exc_info=True)
+    else:
+        response['X-AJAX-Profile-Id'] = request_id
+
+    return response
@@ -0,0 +1,129 @@
+from __future__ import absolute_import
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.functional import Promise
+import six
+
+from ajax.compat import getLogger, path_to_import
+from ajax.conf import settings
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+logger = getLogger('django.request')
+
+
+class AJAXJSONEncoder(DjangoJSONEncoder):
+    """``DjangoJSONEncoder`` that also handles lazy translation strings.
+
+    Validation errors are full of these, and older versions of Django don't
+    encode them.
+    """
+    def default(self, o):
+        if isinstance(o, Promise):
+            return six.text_type(o)
+        return super(AJAXJSONEncoder, self).default(o)
+
+
+class JSONSerializer(object):
+    """Serializes payloads with the standard library's ``json`` module.
+
+    Every serializer returns UTF-8 encoded bytes from ``dumps()`` and handles
+    dates, times, ``Decimal`` and ``UUID`` the same way ``DjangoJSONEncoder``
+    does.
+    """
+    encoder_class = AJAXJSONEncoder
+
+    def dumps(self, data, indent=None):
+        if indent:
+            content = json.dumps(data, cls=self.encoder_class, indent=indent)
+        else:
+            content = json.dumps(data, cls=self.encoder_class,
+                separators=(',', ':'))
+        return content.encode('utf-8')
+
+    def loads(self, content):
+        if isinstance(content, six.binary_type):
+            content = content.decode('utf-8')
+        return json.loads(content)
+
+
+class ORJSONSerializer(JSONSerializer):
+    """Serializes payloads with orjson.
+
+    Dates, times and subclasses of the builtin types are passed through to
+    ``default()`` so they come out exactly like they would from
+    ``DjangoJSONEncoder``. Anything orjson refuses outright (e.g. integers
+    wider than 64 bits) is retried with the standard library.
+    """
+    def __init__(self):
+        self.encoder = self.encoder_class()
+        self.options = (orjson.OPT_NON_STR_KEYS |
+            orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_SUBCLASS)
+
+    def default(self, o):
+        if isinstance(o, dict):
+            # Use items() so that e.g. a QueryDict encodes like it does with
+            # the json module rather than as its underlying lists.
+            return dict(o.items())
+        elif isinstance(o, str):
+            return str(o)
+        elif isinstance(o, list):
+            return list(o)
+        elif isinstance(o, int):
+            return int(o)
+        elif isinstance(o, float):
+            return float(o)
+        return self.encoder.default(o)
+
+    def dumps(self, data, indent=None):
+        options = self.options
+        if indent:
+            options |= orjson.OPT_INDENT_2
+
+        try:
+            return orjson.dumps(data, default=self.default, option=options)
+        except orjson.JSONEncodeError:
+            return super(ORJSONSerializer, self).dumps(data, indent=indent)
+
+    def loads(self, content):
+        return orjson.loads(content)
+
+
+SERIALIZERS = {
+    'json': JSONSerializer,
+    'orjson': ORJSONSerializer,
+}
+
+_serializer = (None, None)
+
+
+def _load_serializer(name):
+    if name == 'orjson' and orjson is None:
+        logger.warning('AJAX_JSON_BACKEND is set to orjson, which is not '
+            'installed. Falling back to json.')
+        name = 'json'
+
+    try:
+        serializer_class = SERIALIZERS[name]
+    except KeyError:
+        serializer_class = path_to_import(name)
+
+    return serializer_class()
+
+
+def get_serializer():
+    """Return the serializer selected by ``AJAX_JSON_BACKEND``.
+
+    The setting is either one of the keys of ``SERIALIZERS`` or the dotted
+    path to a class implementing ``dumps()`` and ``loads()``.
+    """
+    global _serializer
+    name = settings.AJAX_JSON_BACKEND
+    if _serializer[0] != name:
+        _serializer = (name, _load_serializer(name))
+    return _serializer[1]
@@ -4,3 +4,4 @@ import django.dispatch
 ajax_created = django.dispatch.Signal(providing_args=['instance'])
 ajax_deleted = django.dispatch.Signal(providing_args=['instance'])
 ajax_updated = django.dispatch.Signal(providing_args=['instance'])
+ajax_request_finished = django.dispatch.Signal(providing_args=['sample'])
@@ -0,0 +1,330 @@
+"""Query and allocation budgets for endpoints.
+
+Endpoints declare how many queries, and how many bytes of peak memory,
+each of their methods may use: ``ModelEndpoint`` subclasses with the
+``query_budgets`` and ``memory_budgets`` dicts, ad-hoc endpoints with the
+``ajax.decorators.budget`` decorator. ``BudgetTestMixin`` checks them from
+tests and ``sweep`` calls every registered ``ModelEndpoint`` with synthetic
+rows and reports the endpoints that go over budget or whose ``list`` runs
+more queries for bigger pages. Memory is measured with tracemalloc, which
+needs Python 3.
+"""
+from __future__ import absolute_import
+import collections
+import datetime
+import decimal
+import uuid
+
+from django.contrib.auth.models import AnonymousUser
+from django.db import models, transaction
+from django.test import RequestFactory
+from django.utils import timezone
+import six
+
+import ajax
+from ajax.dispatch import AdHocRoute, ModelRoute, table
+from ajax.metrics import _QueryTracker
+from ajax.views import endpoint_loader
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+SWEEP_METHODS = ('get', 'list', 'create', 'update', 'delete')
+
+
+class Usage(object):
+    """Counts the queries and the peak memory allocated in a ``with`` block.
+
+    ``peak_memory`` stays ``None`` when tracemalloc isn't available or
+    ``memory`` is off.
+    """
+    def __init__(self, memory=True):
+        self.queries = 0
+        self.peak_memory = None
+        self._memory = memory and tracemalloc is not None
+
+    def add_query(self, seconds):
+        self.queries += 1
+
+    def __enter__(self):
+        self._tracker = _QueryTracker(self)
+        self._tracker.__enter__()
+        if self._memory:
+            self._started = not tracemalloc.is_tracing()
+            if self._started:
+                tracemalloc.start()
+            elif hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            self._baseline = tracemalloc.get_traced_memory()[0]
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._memory:
+            self.peak_memory = max(0,
+                tracemalloc.get_traced_memory()[1] - self._baseline)
+            if self._started:
+                tracemalloc.stop()
+        self._tracker.__exit__(*exc_info)
+
+
+def get_budget(application, model, method=None):
+    """Return the ``(queries, memory)`` budget declared for an endpoint.
+
+    Either is ``None`` when the endpoint doesn't declare it.
+    """
+    route = table.resolve(application, model, method)
+    if isinstance(route, ModelRoute):
+        return (route.endpoint_class.query_budgets.get(method),
+            route.endpoint_class.memory_budgets.get(method))
+    elif isinstance(route, AdHocRoute):
+        return getattr(route.func, 'ajax_budget', (None, None))
+    return None, None
+
+
+def check_budget(application, model, method, usage, queries=None,
+    memory=None):
+    """Return the ways ``usage`` goes over an endpoint's budget.
+
+    ``queries`` and ``memory`` override the budget the endpoint declares.
+    """
+    declared_queries, declared_memory = get_budget(application, model, method)
+    if queries is None:
+        queries = declared_queries
+    if memory is None:
+        memory = declared_memory
+
+    violations = []
+    if queries is not None and usage.queries > queries:
+        violations.append('ran %d queries, the budget is %d' % (
+            usage.queries, queries))
+    if memory is not None and usage.peak_memory is not None and \
+        usage.peak_memory > memory:
+        violations.append('allocated %d bytes, the budget is %d' % (
+            usage.peak_memory, memory))
+    return violations
+
+
+def call_endpoint(application, model, method=None, pk=None, data=None,
+    user=None, memory=True):
+    """POST ``data`` to an endpoint and return ``(response, usage)``.
+
+    The endpoint is called through ``endpoint_loader`` with a request from
+    ``RequestFactory``, so session and authentication middleware don't add
+    to the queries, and skips the CSRF check like the test client does.
+    ``user`` defaults to an anonymous user.
+    """
+    parts = [application, model]
+    kwargs = {}
+    if pk is not None:
+        parts.append(six.text_type(pk))
+        kwargs['pk'] = six.text_type(pk)
+    if method is not None:
+        parts.append(method)
+        kwargs['method'] = method
+
+    request = RequestFactory().post('/ajax/%s.json' % '/'.join(parts),
+        data or {})
+    request.user = user if user is not None else AnonymousUser()
+    request._dont_enforce_csrf_checks = True  # Like the test client.
+    request.POST  # Parsing isn't part of the endpoint's budget.
+    with Usage(memory) as usage:
+        response = endpoint_loader(request, application, model, **kwargs)
+    return response, usage
+
+
+class BudgetTestMixin(object):
+    """Adds ``assertBudget`` to a ``TestCase``."""
+    def assertBudget(self, application, model, method=None, pk=None,
+        data=None, user=None, queries=None, memory=None, status_code=200):
+        """Call an endpoint and fail if it goes over its budget.
+
+        ``queries`` and ``memory`` override the budget the endpoint
+        declares. Returns ``(response, usage)``.
+        """
+        response, usage = call_endpoint(application, model, method, pk, data,
+            user, memory=True)
+        self.assertEqual(status_code, response.status_code, response.content)
+        violations = check_budget(application, model, method, usage,
+            queries, memory)
+        if violations:
+            raise self.failureException('%s/%s/%s %s.' % (application, model,
+                method, ', '.join(violations)))
+        return response, usage
+
+
+class SyntheticDataError(Exception):
+    pass
+
+
+def synthetic_values(model, index, depth=0):
+    """Return values for the required fields of a new ``model`` row.
+
+    Values are unique per ``index``. Required ForeignKeys get a new
+    synthetic row of their own.
+    """
+    if depth > 3:
+        raise SyntheticDataError('ForeignKeys of %s are nested too deeply.' %
+            model._meta.object_name)
+
+    values = {}
+    for field in model._meta.concrete_fields:
+        if isinstance(field, models.AutoField) or field.null or \
+            field.blank or field.has_default():
+            continue
+
+        if field.choices:
+            values[field.name] = field.flatchoices[0][0]
+        elif isinstance(field, models.ForeignKey):
+            values[field.name] = synthetic_instance(field.rel.to, index,
+                depth + 1)
+        else:
+            values[field.name] = _synthetic_value(model, field, index)
+    return values
+
+
+def synthetic_instance(model, index, depth=0):
+    """Save and return a synthetic ``model`` row."""
+    return model.objects.create(**synthetic_values(model, index, depth))
+
+
+def _synthetic_value(model, field, index):
+    if isinstance(field, models.EmailField):
+        return 'user%d@example.com' % index
+    elif isinstance(field, models.URLField):
+        return 'http://example.com/%d' % index
+    elif isinstance(field, (models.CharField, models.TextField)):
+        value = '%s-%d' % (field.name, index)
+        return value[-field.max_length:] if field.max_length else value
+    elif isinstance(field, models.BooleanField):
+        return True
+    elif isinstance(field, models.IntegerField):
+        return index + 1
+    elif isinstance(field, models.FloatField):
+        return float(index)
+    elif isinstance(field, models.DecimalField):
+        return decimal.Decimal(index % 10)
+    elif isinstance(field, models.DateTimeField):
+        return timezone.now()
+    elif isinstance(field, models.DateField):
+        return datetime.date.today()
+    elif isinstance(field, models.TimeField):
+        return datetime.time(12)
+    elif isinstance(field, models.GenericIPAddressField):
+        return '127.0.0.1'
+    elif getattr(models, 'UUIDField', None) and \
+        isinstance(field, models.UUIDField):
+        return uuid.uuid4()
+
+    raise SyntheticDataError("Can't make up a value for %s.%s." % (
+        model._meta.object_name, field.name))
+
+
+def _post_value(value):
+    if isinstance(value, models.Model):
+        return six.text_type(value.pk)
+    elif isinstance(value, bool):
+        return 'true' if value else 'false'
+    elif isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return six.text_type(value)
+
+
+def synthetic_data(model, index):
+    """Return POST data creating a synthetic ``model`` row."""
+    return dict((name, _post_value(value)) for name, value in
+        six.iteritems(synthetic_values(model, index)))
+
+
+class Violation(collections.namedtuple('Violation',
+    ['application', 'model', 'method', 'message'])):
+    def __str__(self):
+        return '%s/%s/%s: %s' % self
+
+
+class _RollBack(Exception):
+    pass
+
+
+def sweep(user, rows=10, methods=SWEEP_METHODS):
+    """Call every registered ``ModelEndpoint`` and return the ``Violation``s.
+
+    Each endpoint gets ``rows`` synthetic rows and is called as ``user``,
+    within a transaction that is rolled back. Besides going over budget,
+    ``list`` running more queries for ``rows`` records than for one and any
+    error other than a 403 are reported. ``rows`` must be at least 1.
+    """
+    if rows < 1:
+        raise ValueError('rows must be at least 1, got %r.' % rows)
+
+    violations = []
+    for (application, name), model in sorted(ajax.endpoint._index.items()):
+        try:
+            with transaction.atomic():
+                violations.extend(_sweep_endpoint(application, name, model,
+                    user, rows, methods))
+                raise _RollBack()
+        except _RollBack:
+            pass
+    return violations
+
+
+def _sweep_endpoint(application, name, model, user, rows, methods):
+    try:
+        records = [synthetic_instance(model, index) for index in range(rows)]
+    except SyntheticDataError as e:
+        return [Violation(application, name, None,
+            'skipped: %s' % e)]
+
+    routes = table.routes()
+    calls = {
+        'get': {'pk': records[0].pk},
+        'list': {'data': {'items_per_page': rows}},
+        'create': {'data': synthetic_data(model, rows)},
+        'update': {'pk': records[1 % rows].pk,
+            'data': synthetic_data(model, rows + 1)},
+        'delete': {'pk': records[-1].pk},
+    }
+
+    violations = []
+    for method in methods:
+        if (application, name, method) not in routes:
+            continue
+
+        def report(message):
+            violations.append(Violation(application, name, method, message))
+
+        response, usage = _call_in_savepoint(application, name, method,
+            user=user, **calls[method])
+        if response.status_code == 403:
+            continue  # Not allowed for this user, which is a choice.
+        elif response.status_code != 200:
+            report('returned %d: %s' % (response.status_code,
+                response.content.decode('utf-8')))
+            continue
+
+        for message in check_budget(application, name, method, usage):
+            report(message)
+
+        if method == 'list' and rows > 1:
+            response, single = _call_in_savepoint(application, name, method,
+                data={'items_per_page': 1}, user=user, memory=False)
+            if usage.queries > single.queries:
+                report('ran %d queries for %d records but %d for one' % (
+                    usage.queries, rows, single.queries))
+    return violations
+
+
+def _call_in_savepoint(application, name, method, **kwargs):
+    """``call_endpoint`` in a savepoint of its own.
+
+    Endpoints turn database errors into a 500, which would otherwise leave
+    the sweep's transaction unusable for the methods called after it.
+    """
+    with transaction.atomic():
+        response, usage = call_endpoint(application, name, method, **kwargs)
+        if response.status_code != 200:
+            transaction.set_rollback(True)
+    return response, usage
@@ -9,6 +9,7 @@ JAVASCRIPT_PATH = "%s/js" % os.path.dirname(__file__)
 
 if django.VERSION < (1, 8):
     urlpatterns = patterns('ajax.views',
+        (r'^batch.json$', 'batch_loader'),
         (r'^(?P<application>\w+)/(?P<model>\w+).json', 'endpoint_loader'),
         (r'^(?P<application>\w+)/(?P<model>\w+)/(?P<method>\w+).json', 'endpoint_loader'),
         (r'^(?P<application>\w+)/(?P<model>\w+)/(?P<pk>\d+)/(?P<method>\w+)/?(?P<taggit_command>(add|remove|set|clear|similar))?.json$', 'endpoint_loader'),
@@ -17,6 +18,7 @@ if django.VERSION < (1, 8):
     )
 else:
     urlpatterns = [
+        url(r'^batch.json$', views.batch_loader),
         url(r'^(?P<application>\w+)/(?P<model>\w+).json', views.endpoint_loader),
         url(r'^(?P<application>\w+)/(?P<model>\w+)/(?P<method>\w+).json', views.endpoint_loader),
         url(r'^(?P<application>\w+)/(?P<model>\w+)/(?P<pk>\d+)/(?P<method>\w+)/?(?P<taggit_command>(add|remove|set|clear|similar))?.json$', views.endpoint_loader),
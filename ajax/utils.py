@@ -1,5 +1,8 @@
 from __future__ import absolute_import
+from collections import OrderedDict
 import sys
+import threading
+import time
 
 from django.core.exceptions import ImproperlyConfigured
 from ajax.compat import import_module
@@ -30,3 +33,54 @@ def import_by_path(dotted_path, error_prefix=''):
             )
         )
     return attr
+
+
+def bump_version(cache, key):
+    """Orphan every cache entry built with the version stored at ``key``."""
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, int(time.time()), None)
+
+
+class ExpiringLRUCache(object):
+    """A small thread-safe, process-local LRU cache with per-entry TTLs.
+
+    Once ``max_size`` entries are stored the least recently used one is
+    evicted. Expired entries are dropped when they are looked up.
+    """
+    def __init__(self, max_size=1000):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires, value = self._data.pop(key)
+            except KeyError:
+                return default
+
+            if expires < time.time():
+                return default
+
+            self._data[key] = (expires, value)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (time.time() + ttl, value)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
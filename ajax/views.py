@@ -1,15 +1,22 @@
 from __future__ import absolute_import
+import copy
+import hashlib
 
-import json
-from django.conf import settings
-from django.http import HttpResponse
+from django.db import transaction
+from django.http import (HttpResponse, HttpResponseNotModified, QueryDict,
+    StreamingHttpResponse)
+from django.http.response import HttpResponseBase
+from django.utils.cache import patch_cache_control, patch_vary_headers
 from django.utils.translation import ugettext as _
 from ajax.compat import getLogger
-from django.core.serializers.json import DjangoJSONEncoder
-from ajax.exceptions import AJAXError, NotRegistered
-from ajax.decorators import json_response
-from ajax.compat import import_module
-import ajax
+from ajax.conf import settings
+from ajax.exceptions import AJAXError
+from ajax.decorators import (api_key_csrf_exempt, error_from_exception,
+    json_response)
+from ajax.dispatch import table
+from ajax.metrics import instrumented, label, timed
+from ajax.serializers import get_serializer
+import six
 
 
 logger = getLogger('django.request')
@@ -23,59 +30,138 @@ class EnvelopedResponse(object):
     :param: data - The object representation that you want to return
     :param: metadata - dict of information which will be merged with the
                        envelope.
+    :param: etag - strong validator for the response. Computed from the
+                   serialized envelope when not given.
     """
-    def __init__(self, data, metadata):
+    def __init__(self, data, metadata, etag=None):
         self.data = data
         self.metadata = metadata
+        self.etag = etag
 
+
+def make_etag(*parts):
+    """Return a quoted strong ETag built from ``parts``."""
+    digest = hashlib.md5()
+    for part in parts:
+        digest.update(part if isinstance(part, six.binary_type) else
+            six.text_type(part).encode('utf-8'))
+    return '"%s"' % digest.hexdigest()
+
+
+def etag_matches(request, etag):
+    """Whether ``etag`` satisfies the request's ``If-None-Match`` header."""
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+
+    # If-None-Match uses the weak comparison, so W/ prefixes don't matter.
+    tags = [tag.strip() for tag in header.split(',')]
+    return '*' in tags or etag in [tag[2:] if tag.startswith('W/') else tag
+        for tag in tags]
+
+
+def not_modified(etag):
+    response = HttpResponseNotModified()
+    response['ETag'] = etag
+    return response
+
+
+class StreamingEnvelopedResponse(StreamingHttpResponse):
+    """
+    Streams an enveloped JSON list to the client as it is being encoded.
+
+    The envelope prefix is written first, followed by the items of ``data``
+    serialized ``chunk_size`` at a time and finally the ``metadata``. Neither
+    the encoded items nor the full JSON document are ever held in memory, so
+    ``data`` should be a generator. Keep in mind that errors raised while
+    streaming can no longer be turned into an error response.
+
+    :param: data - iterable of JSON encodable items
+    :param: metadata - dict of information which will be merged with the
+                       envelope.
+    :param: chunk_size - number of items serialized per chunk.
+    """
+    def __init__(self, data, metadata=None, chunk_size=100, **kwargs):
+        kwargs.setdefault('content_type', 'application/json')
+        super(StreamingEnvelopedResponse, self).__init__(
+            self._stream(data, metadata or {}, chunk_size), **kwargs)
+
+    def _stream(self, data, metadata, chunk_size):
+        dumps = get_serializer().dumps
+        yield b'{"success":true,"data":['
+        separator = b''
+        chunk = []
+        for item in data:
+            chunk.append(item)
+            if len(chunk) >= chunk_size:
+                yield separator + dumps(chunk)[1:-1]
+                separator = b','
+                chunk = []
+
+        if chunk:
+            yield separator + dumps(chunk)[1:-1]
+
+        if metadata:
+            yield b'],' + dumps(metadata)[1:]
+        else:
+            yield b']}'
+
+@api_key_csrf_exempt
+@instrumented
 @json_response
 def endpoint_loader(request, application, model, **kwargs):
     """Load an AJAX endpoint.
 
     This will load either an ad-hoc endpoint or it will load up a model
-    endpoint depending on what it finds. It first attempts to load ``model``
-    as if it were an ad-hoc endpoint. Alternatively, it will attempt to see if
-    there is a ``ModelEndpoint`` for the given ``model``.
+    endpoint depending on what it finds. An ad-hoc endpoint named ``model``
+    takes precedence over a ``ModelEndpoint`` for the given ``model``. Both
+    are looked up in the precomputed ``ajax.dispatch.table``.
+
+    Responses of read-only methods carry an ``ETag`` and a matching
+    ``If-None-Match`` is answered with a 304. Endpoints that allow it can
+    also be read with GET, taking their parameters from the query string,
+    in which case the endpoint's ``Cache-Control`` and ``Vary`` are set.
+    Requests are measured by ``ajax.metrics`` when ``AJAX_METRICS`` is on.
     """
-    if request.method != "POST":
+    safe = request.method in ('GET', 'HEAD')
+    if request.method != "POST" and not safe:
         raise AJAXError(400, _('Invalid HTTP method used.'))
 
-    try:
-        module = import_module('%s.endpoints' % application)
-    except ImportError as e:
-        if settings.DEBUG:
-            raise e
-        else:
-            raise AJAXError(404, _('AJAX endpoint does not exist.'))
+    method = kwargs.pop('method', 'create').lower()
+    route = table.resolve(application, model, method)
+    label(application, model, method)
+    if safe:
+        if not route.allow_get:
+            raise AJAXError(400, _('Invalid HTTP method used.'))
+        # Endpoints read their parameters from POST.
+        request = copy.copy(request)
+        request.POST = request.GET
 
-    if hasattr(module, model):
-        # This is an ad-hoc endpoint
-        endpoint = getattr(module, model)
+    data = route(request, application, **kwargs)
+    if isinstance(data, HttpResponseBase):
+        response = data
     else:
-        # This is a model endpoint
-        method = kwargs.get('method', 'create').lower()
-        try:
-            del kwargs['method']
-        except:
-            pass
+        with timed('serialize'):
+            content = get_serializer().dumps(_envelope(data))
+        response = HttpResponse(content)
+        if route.conditional:
+            etag = getattr(data, 'etag', None) or make_etag(response.content)
+            if etag_matches(request, etag):
+                response = not_modified(etag)
+            else:
+                response['ETag'] = etag
 
-        try:
-            model_endpoint = ajax.endpoint.load(model, application, method,
-                **kwargs)
-            if not model_endpoint.authenticate(request, application, method):
-                raise AJAXError(403, _('User is not authorized.'))
-
-            endpoint = getattr(model_endpoint, method, False)
+    if safe:
+        if route.cache_control is None:
+            patch_cache_control(response, private=True)
+        else:
+            patch_cache_control(response, **route.cache_control)
+        patch_vary_headers(response, route.vary)
 
-            if not endpoint:
-                raise AJAXError(404, _('Invalid method.'))
-        except NotRegistered:
-            raise AJAXError(500, _('Invalid model.'))
+    return response
 
-    data = endpoint(request)
-    if isinstance(data, HttpResponse):
-        return data
 
+def _envelope(data):
     if isinstance(data, EnvelopedResponse):
         envelope = data.metadata
         payload = data.data
@@ -87,6 +173,139 @@ def endpoint_loader(request, application, model, **kwargs):
         'success': True,
         'data': payload,
     })
+    return envelope
+
+
+class _RollBack(Exception):
+    pass
+
+
+def _batch_value(value):
+    if value is None:
+        return 'null'
+    elif isinstance(value, bool):
+        return 'true' if value else 'false'
+    elif isinstance(value, (dict, list, tuple)):
+        # Sent as JSON, the way ``bulk_create`` and friends expect them.
+        return get_serializer().dumps(value).decode('utf-8')
+    return six.text_type(value)
+
+
+def _batch_request(request, data):
+    """Copy ``request`` with ``data`` standing in for its POST."""
+    sub_request = copy.copy(request)
+    # Conditional responses can't be batched.
+    sub_request.META = dict(request.META)
+    sub_request.META.pop('HTTP_IF_NONE_MATCH', None)
+    post = QueryDict('', mutable=True)
+    for key, value in six.iteritems(data):
+        post[key] = _batch_value(value)
+    sub_request.POST = post
+    return sub_request
+
+
+def _run_operation(request, operation):
+    """Run a single batched operation and return its envelope."""
+    try:
+        if not isinstance(operation, dict):
+            raise AJAXError(400, _('Invalid operation.'))
+
+        application = operation.get('application')
+        model = operation.get('model')
+        data = operation.get('data') or {}
+        if not isinstance(application, six.string_types) or \
+            not isinstance(model, six.string_types) or \
+            not isinstance(data, dict):
+            raise AJAXError(400, _('Invalid operation.'))
+
+        kwargs = {}
+        if operation.get('pk') is not None:
+            kwargs['pk'] = six.text_type(operation['pk'])
+        if operation.get('taggit_command'):
+            kwargs['taggit_command'] = operation['taggit_command']
+
+        method = (operation.get('method') or 'create').lower()
+        route = table.resolve(application, model, method)
+        # A savepoint, so a failing operation only rolls back itself and
+        # leaves an outer transaction usable for the next ones.
+        with transaction.atomic():
+            result = route(_batch_request(request, data), application,
+                **kwargs)
+            if isinstance(result, HttpResponseBase):
+                raise AJAXError(400, _('Endpoint can not be batched.'))
+
+        return _envelope(result)
+    except Exception as e:
+        return error_from_exception(request, e).to_dict()
+
+
+def _parse_batch(request):
+    serializer = get_serializer()
+    try:
+        if request.META.get('CONTENT_TYPE', '').startswith('application/json'):
+            payload = serializer.loads(request.body)
+        else:
+            payload = {
+                'operations': serializer.loads(
+                    request.POST.get('operations', '[]')),
+                'atomic': request.POST.get('atomic', '').lower() in
+                    ('1', 'true'),
+            }
+    except ValueError:
+        raise AJAXError(400, _('Invalid batch.'))
+
+    if isinstance(payload, list):
+        payload = {'operations': payload}
+
+    operations = payload.get('operations') if isinstance(payload, dict) \
+        else None
+    if not isinstance(operations, list):
+        raise AJAXError(400, _('Invalid batch.'))
+
+    if len(operations) > settings.AJAX_BATCH_MAX_OPERATIONS:
+        raise AJAXError(400, _('Too many operations in batch.'))
+
+    return operations, bool(payload.get('atomic'))
+
+
+@api_key_csrf_exempt
+@json_response
+def batch_loader(request):
+    """Run several endpoint operations in a single request.
+
+    The POST carries a JSON list of operations, either as the request body
+    or in the ``operations`` field, each looking like::
+
+        {"application": "my_app", "model": "category", "pk": 1,
+         "method": "update", "data": {"title": "New title"}}
+
+    Every operation is resolved and authenticated exactly like a request to
+    ``endpoint_loader`` and gets its own envelope in the returned list. When
+    ``atomic`` is set all operations run in one transaction, which is
+    rolled back, skipping the remaining operations, as soon as one fails.
+    """
+    if request.method != "POST":
+        raise AJAXError(400, _('Invalid HTTP method used.'))
+
+    operations, atomic = _parse_batch(request)
+    results = []
+    rolled_back = False
+    if atomic:
+        try:
+            with transaction.atomic():
+                for operation in operations:
+                    result = _run_operation(request, operation)
+                    results.append(result)
+                    if not result['success']:
+                        raise _RollBack()
+        except _RollBack:
+            rolled_back = True
+    else:
+        for operation in operations:
+            results.append(_run_operation(request, operation))
+
+    envelope = {'success': not rolled_back, 'data': results}
+    if atomic:
+        envelope['rolled_back'] = rolled_back
 
-    return HttpResponse(json.dumps(envelope, cls=DjangoJSONEncoder,
-        separators=(',', ':')))
+    return HttpResponse(get_serializer().dumps(envelope))
@@ -0,0 +1,261 @@
+"""Benchmarks of encoders, dispatch and ``ModelEndpoint`` methods.
+
+Run them with ``make bench`` or ``python tests/manage.py ajax_benchmark``,
+which creates a throwaway SQLite database, fills it with ``Widget`` and
+``Category`` rows for every size and writes the results as JSON so runs on
+different commits can be compared.
+"""
+from __future__ import absolute_import
+import copy
+import itertools
+import platform
+import sqlite3
+import subprocess
+import time
+from timeit import default_timer
+
+import django
+from django.contrib.auth.models import User
+from django.test import RequestFactory
+
+from ajax.conf import settings
+from ajax.encoders import encoder, ExcludeEncoder, IncludeEncoder
+from ajax.views import endpoint_loader
+
+from .models import Category, Widget
+
+
+SIZES = (1000, 10000, 100000)
+ENCODE_BATCH = 100
+ITEMS_PER_PAGE = 20
+
+
+class Benchmark(object):
+    """A named operation timed per ``unit``.
+
+    ``func`` handles ``per_call`` units (e.g. records encoded) per call.
+    """
+    def __init__(self, name, func, unit='request', per_call=1):
+        self.name = name
+        self.func = func
+        self.unit = unit
+        self.per_call = per_call
+
+
+def populate(size):
+    """Replace the rows of the example models with ``size`` widgets spread
+    over ``size / 10`` categories."""
+    Widget.objects.all().delete()
+    Category.objects.all().delete()
+    Category.objects.bulk_create([Category(title='Category %d' % i)
+        for i in range(max(1, size // 10))], batch_size=500)
+    category_ids = list(Category.objects.values_list('pk', flat=True))
+    Widget.objects.bulk_create([Widget(
+        category_id=category_ids[i % len(category_ids)],
+        title='Widget %d' % i,
+        description='<b>Widget</b> %d & co' % i,
+        active=bool(i % 3),
+    ) for i in range(size)], batch_size=200)
+
+
+class _Encoding(object):
+    """Encode with ``model_encoder`` registered for ``Widget``."""
+    def __init__(self, model_encoder):
+        self.model_encoder = model_encoder
+
+    def __enter__(self):
+        self.previous = encoder._registry.get(Widget)
+        if self.previous is not None:
+            encoder.unregister(Widget)
+        encoder.register(Widget, self.model_encoder)
+
+    def __exit__(self, *exc_info):
+        encoder.unregister(Widget)
+        if self.previous is not None:
+            encoder.register(Widget, self.previous)
+
+
+def _encode(records, model_encoder=None, **kwargs):
+    def func():
+        if model_encoder is None:
+            return encoder.encode(records, **kwargs)
+        with _Encoding(model_encoder):
+            return encoder.encode(records, **kwargs)
+    return func
+
+
+def _loader(request, model, **kwargs):
+    """Call ``endpoint_loader`` like the URL resolver would.
+
+    The request is built once, so parsing it isn't part of the timing.
+    """
+    def func():
+        response = endpoint_loader(copy.copy(request), 'example', model,
+            **kwargs)
+        if response.status_code != 200:
+            raise AssertionError('%s returned %d: %s' % (request.path,
+                response.status_code, response.content))
+        return response
+    return func
+
+
+def benchmarks(size, user):
+    """Return the ``Benchmark``s to run against ``size`` rows."""
+    factory = RequestFactory()
+
+    def post(path, data=None):
+        request = factory.post(path, data or {})
+        request.user = user
+        request._dont_enforce_csrf_checks = True  # Like the test client.
+        request.POST  # Parse it up front.
+        return request
+
+    records = list(Widget.objects.order_by('pk')[:ENCODE_BATCH])
+    pk = str(records[0].pk)
+    pages = (size + ITEMS_PER_PAGE - 1) // ITEMS_PER_PAGE
+    # Alternate between two titles so every update writes.
+    updates = itertools.cycle([_loader(post(
+        '/ajax/example/widget/%s/update.json' % pk, {'title': title}),
+        'widget', pk=pk, method='update') for title in ('Foo', 'Bar')])
+
+    def update():
+        return next(updates)()
+
+    result = [
+        Benchmark('encode.plain', _encode(records), 'record', len(records)),
+        Benchmark('encode.expand', _encode(records, expand=True), 'record',
+            len(records)),
+        Benchmark('encode.html_escape', _encode(records, html_escape=True),
+            'record', len(records)),
+        Benchmark('encode.include', _encode(records,
+            IncludeEncoder(include=['title', 'active'])), 'record',
+            len(records)),
+        Benchmark('encode.exclude', _encode(records,
+            ExcludeEncoder(exclude=['description'])), 'record',
+            len(records)),
+        Benchmark('dispatch.adhoc', _loader(post('/ajax/example/lookup.json',
+            {'q': 'widget'}), 'lookup')),
+        Benchmark('dispatch.get', _loader(post(
+            '/ajax/example/widget/%s/get.json' % pk), 'widget', pk=pk,
+            method='get')),
+    ]
+
+    for depth, page in (('first', 1), ('middle', max(1, pages // 2)),
+        ('last', pages)):
+        result.append(Benchmark('list.%s' % depth, _loader(post(
+            '/ajax/example/widget/list.json', {
+                'items_per_page': ITEMS_PER_PAGE,
+                'current_page': page,
+            }), 'widget', method='list')))
+
+    result.extend([
+        Benchmark('create', _loader(post('/ajax/example/widget/create.json',
+            {'title': 'Created', 'description': 'Benchmark'}), 'widget',
+            method='create')),
+        Benchmark('update', update),
+    ])
+    return result
+
+
+def measure(func, min_time=0.2, repeat=5):
+    """Time ``func`` and return the seconds per call of each round.
+
+    The number of calls per round is raised until a round takes at least
+    ``min_time`` seconds.
+    """
+    func()  # Warm up caches and fail early.
+    number = 1
+    while True:
+        elapsed = _time(func, number)
+        if elapsed >= min_time or number >= 10 ** 6:
+            break
+        number *= 10 if elapsed < min_time / 10 else 2
+
+    rounds = [elapsed] + [_time(func, number) for i in range(repeat - 1)]
+    return number, [elapsed / number for elapsed in rounds]
+
+
+def _time(func, number):
+    start = default_timer()
+    for i in range(number):
+        func()
+    return default_timer() - start
+
+
+def _median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def _commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+            stderr=subprocess.STDOUT).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def metadata():
+    return {
+        'commit': _commit(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'django': django.get_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'json_backend': settings.AJAX_JSON_BACKEND,
+    }
+
+
+def run(sizes=SIZES, min_time=0.2, repeat=5, only=None, log=None):
+    """Run the benchmarks against every size and return the results.
+
+    ``only`` is a list of benchmark name prefixes to run. ``log`` is called
+    with every result as it comes in.
+    """
+    user, created = User.objects.get_or_create(username='benchmark',
+        defaults={'is_staff': True})
+    results = []
+    for size in sizes:
+        populate(size)
+        for benchmark in benchmarks(size, user):
+            if only and not any(benchmark.name.startswith(prefix)
+                for prefix in only):
+                continue
+
+            number, rounds = measure(benchmark.func, min_time, repeat)
+            per_unit = [seconds / benchmark.per_call for seconds in rounds]
+            result = {
+                'name': benchmark.name,
+                'size': size,
+                'unit': benchmark.unit,
+                'number': number * benchmark.per_call,
+                'repeat': repeat,
+                'min': min(per_unit),
+                'median': _median(per_unit),
+                'max': max(per_unit),
+            }
+            result['per_second'] = 1 / result['median'] \
+                if result['median'] else None
+            results.append(result)
+            if log is not None:
+                log(result)
+    return results
+
+
+def compare(baseline, results):
+    """Return ``(name, size, baseline median, median, change)`` for every
+    result also in ``baseline``, ``change`` being the relative slowdown."""
+    medians = dict(((result['name'], result['size']), result['median'])
+        for result in baseline)
+    rows = []
+    for result in results:
+        before = medians.get((result['name'], result['size']))
+        if before:
+            rows.append((result['name'], result['size'], before,
+                result['median'], result['median'] / before - 1))
+    return rows
@@ -1,6 +1,6 @@
 from __future__ import absolute_import
 from ajax import endpoint
-from ajax.decorators import login_required
+from ajax.decorators import login_required, read_only
 from ajax.endpoints import ModelEndpoint
 from .models import Widget, Category
 
@@ -11,6 +11,12 @@ def echo(request):
     return request.POST
 
 
+@read_only(cache_control={'max_age': 60})
+def lookup(request):
+    """For testing purposes only."""
+    return request.POST
+
+
 class WidgetEndpoint(ModelEndpoint):
     model = Widget
     max_per_page = 100
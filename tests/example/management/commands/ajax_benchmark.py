@@ -0,0 +1,80 @@
+from __future__ import absolute_import
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from example import benchmarks
+
+
+def _sizes(value):
+    return [int(size) for size in value.split(',')]
+
+
+class Command(BaseCommand):
+    help = ('Benchmarks encoders, dispatch and list, create and update '
+        'requests against a throwaway SQLite database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=_sizes,
+            default=list(benchmarks.SIZES),
+            help='Comma separated numbers of widgets to run against.')
+        parser.add_argument('--only', action='append',
+            help='Only run benchmarks whose name starts with this. '
+                'Can be given several times.')
+        parser.add_argument('--min-time', type=float, default=0.2,
+            help='Minimum seconds per round.')
+        parser.add_argument('--repeat', type=int, default=5,
+            help='Number of rounds.')
+        parser.add_argument('--output',
+            help='Write the results to this JSON file.')
+        parser.add_argument('--compare',
+            help='JSON file of an earlier run to compare against.')
+        parser.add_argument('--threshold', type=float,
+            help='Fail when a median is this many percent slower than in '
+                '--compare.')
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)['results']
+
+        old_name = connection.creation.create_test_db(verbosity=0,
+            autoclobber=True, serialize=False)
+        try:
+            # DEBUG would log every query.
+            with override_settings(DEBUG=False):
+                results = benchmarks.run(options['sizes'],
+                    options['min_time'], options['repeat'], options['only'],
+                    log=self.log)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({'meta': benchmarks.metadata(), 'results': results},
+                    f, indent=2, sort_keys=True)
+
+        if baseline is not None:
+            self.report(baseline, results, options['threshold'])
+
+    def log(self, result):
+        self.stdout.write('%-20s %7d %12.2f us/%-7s %12.0f/s' % (
+            result['name'], result['size'], result['median'] * 10 ** 6,
+            result['unit'], result['per_second'] or 0))
+
+    def report(self, baseline, results, threshold):
+        regressions = []
+        self.stdout.write('')
+        for name, size, before, after, change in benchmarks.compare(
+            baseline, results):
+            self.stdout.write('%-20s %7d %12.2f us %12.2f us %+7.1f%%' % (
+                name, size, before * 10 ** 6, after * 10 ** 6, change * 100))
+            if threshold is not None and change * 100 > threshold:
+                regressions.append('%s (%d)' % (name, size))
+
+        if regressions:
+            raise CommandError('Slower than the baseline: %s' %
+                ', '.join(regressions))
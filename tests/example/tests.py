@@ -1,17 +1,39 @@
 from __future__ import absolute_import
 from __future__ import print_function
+import datetime
+import decimal
 import json
+import os
+import pstats
+import shutil
+import tempfile
+import time
+import unittest
+import uuid
 
 import mock
 
-from django.test import TestCase
+from django.core.management import CommandError, call_command
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+from django.test import Client, TestCase
 from django.contrib.auth.models import User
-from django.utils import six
+from django.utils import six, timezone
+from django.utils.html import escape
 
 from ajax.endpoints import ModelEndpoint
 from ajax.exceptions import AJAXError
-from ajax.signals import ajax_deleted
+from ajax import metrics, profiling, testing
+from ajax.authentication import APIKeyAuthentication
+from ajax.models import APIKey, hash_key
+from ajax.signals import ajax_deleted, ajax_request_finished
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from . import benchmarks, endpoints as example_endpoints
 from .models import Widget, Category
 from .endpoints import WidgetEndpoint, CategoryEndpoint
 
@@ -67,6 +89,56 @@ class EncodeTests(BaseTest):
             for k in ('title','active','description'):
                 self.assertEquals(encoded[k],getattr(widget,k))
 
+    def test_encode_normalizes_fields(self):
+        from ajax.encoders import encoder
+        encoded = encoder.encode(Widget.objects.get(pk=3))
+        self.assertEquals({
+            'pk': 3,
+            'category': 1,
+            'title': 'Sorem ipsum dolor lit amet',
+            'description': None,
+            'active': True,
+        }, encoded)
+
+    def test_encode_html_escape(self):
+        from ajax.encoders import encoder
+        widget = Widget.objects.get(pk=1)
+        widget.title = '<b>bold</b>'
+        encoded = encoder.encode(widget, html_escape=True)
+        self.assertEquals('&lt;b&gt;bold&lt;/b&gt;', encoded['title'])
+        self.assertEquals(False, encoded['active'])
+
+    def test_plans_are_cached(self):
+        from ajax.encoders import encoder, DefaultEncoder, IncludeEncoder
+        encoder.encode(Widget.objects.get(pk=1))
+        plan = encoder.get_plan(DefaultEncoder(), Widget)
+        encoder.encode(Widget.objects.get(pk=2))
+        self.assertTrue(plan is encoder.get_plan(DefaultEncoder(), Widget))
+        self.assertFalse(plan is encoder.get_plan(DefaultEncoder(), Widget,
+            html_escape=True))
+
+        encoded = IncludeEncoder(['title'])(Widget.objects.get(pk=1))
+        self.assertEquals(set(['pk', 'title']), set(encoded))
+
+    def test_expand_queryset_batches_foreign_keys(self):
+        from ajax.encoders import encoder
+        with self.assertNumQueries(2):
+            encoded = encoder.encode(Widget.objects.order_by('pk'), expand=True)
+
+        self.assertEquals(None, encoded[0]['category'])
+        self.assertEquals({'pk': 1, 'title': Category.objects.get(pk=1).title},
+            encoded[2]['category'])
+
+        widget = Widget.objects.get(pk=3)
+        self.assertEquals(encoder.encode(widget, expand=True), encoded[2])
+
+    def test_expand_uses_select_related(self):
+        from ajax.encoders import encoder
+        widgets = Widget.objects.select_related('category')
+        with self.assertNumQueries(1):
+            encoded = encoder.encode(widgets, expand=True)
+        self.assertEquals(4, len([w for w in encoded if w['category']]))
+
 
 class EndpointTests(BaseTest):
     def test_echo(self):
@@ -90,6 +162,77 @@ class EndpointTests(BaseTest):
         self.assertEquals(None, content['data']['category'])
         self.assertEquals(None, Widget.objects.get(pk=6).category)
 
+    def test_unknown_application_is_404_without_import(self):
+        from ajax.dispatch import table
+        table.routes()
+        with mock.patch('ajax.dispatch.import_module') as mock_import:
+            resp, content = self.post('/ajax/nonexistent/echo.json',
+                status_code=404)
+            self.assertFalse(mock_import.called)
+
+    def test_unknown_model_and_method(self):
+        self.post('/ajax/example/gadget/list.json', status_code=500)
+        self.post('/ajax/example/widget/1/explode.json', status_code=404)
+        self.post('/ajax/example/widget/1/_save.json', status_code=404)
+        self.post('/ajax/example/widget/1/can_update.json', status_code=404)
+
+    def test_skipped_adhoc_endpoints_are_logged(self):
+        import types
+        from ajax import dispatch
+        from ajax.decorators import login_required
+
+        def plain_decorator(func):
+            def wrapper(request):
+                return func(request)
+            return wrapper
+
+        module = types.ModuleType('example.other_endpoints')
+        module.ping = plain_decorator(lambda request: {})
+        module.login_required = login_required
+        with mock.patch.object(dispatch.logger, 'warning') as warning:
+            self.assertEqual([], list(dispatch._adhoc_endpoints(module)))
+        self.assertEqual(1, warning.call_count)
+        self.assertEqual('ping', warning.call_args[0][2])
+
+        module.__all__ = ['ping']
+        self.assertEqual([('ping', module.ping)],
+            list(dispatch._adhoc_endpoints(module)))
+
+    def test_dispatch_table_command(self):
+        from django.core.management import call_command
+        out = six.StringIO()
+        call_command('ajax_routes', stdout=out)
+        self.assertTrue('example/echo.json' in out.getvalue())
+        self.assertTrue('example/widget/list.json' in out.getvalue())
+        self.assertFalse('login_required' in out.getvalue())
+
+    def test_update_fetches_once_and_writes_changed_fields(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as queries:
+            resp, content = self.post('/ajax/example/widget/3/update.json',
+                {'title': 'Changed', 'active': True, 'category': 1})
+
+        widget_queries = [q['sql'] for q in queries
+            if 'example_widget' in q['sql']]
+        self.assertEquals(2, len(widget_queries))
+        self.assertTrue(widget_queries[0].startswith('SELECT'))
+        self.assertTrue(widget_queries[1].startswith('UPDATE'))
+        self.assertTrue('"title"' in widget_queries[1])
+        self.assertFalse('"active"' in widget_queries[1])
+        self.assertFalse('"category_id"' in widget_queries[1])
+        self.assertEquals('Changed', content['data']['title'])
+        self.assertEquals('Changed', Widget.objects.get(pk=3).title)
+
+    def test_partial_validation(self):
+        Widget.objects.filter(pk=3).update(description='x' * 300)
+        resp, content = self.post('/ajax/example/widget/3/update.json',
+            {'title': 'Changed'}, status_code=400)
+        with mock.patch.object(WidgetEndpoint, 'partial_validation', True):
+            resp, content = self.post('/ajax/example/widget/3/update.json',
+                {'title': 'Changed'})
+        self.assertEquals('Changed', Widget.objects.get(pk=3).title)
+
     def test_logged_out_user_fails(self):
         """Make sure @login_required rejects requests to echo."""
         self.client.logout()
@@ -111,6 +254,820 @@ class EndpointTests(BaseTest):
             self.assertFalse(mock_save.called)
 
 
+class EndpointsRegistryTests(TestCase):
+    def setUp(self):
+        from ajax.endpoints import Endpoints
+        self.registry = Endpoints()
+        self.registry.register(Widget, WidgetEndpoint)
+
+    def test_load_matches_application(self):
+        from ajax.exceptions import NotRegistered
+        endpoint = self.registry.load('widget', 'example', 'get', pk=1)
+        self.assertTrue(isinstance(endpoint, WidgetEndpoint))
+        self.assertEquals('1', str(endpoint.pk))
+        self.assertRaises(NotRegistered, self.registry.load, 'widget',
+            'other', 'get')
+        self.assertRaises(NotRegistered, self.registry.load, 'category',
+            'example', 'get')
+
+    def test_duplicate_name_is_rejected(self):
+        from ajax.exceptions import AlreadyRegistered
+
+        class Options(object):
+            app_label = 'example'
+
+        Impostor = type('Widget', (object,), {'_meta': Options})
+        self.assertRaises(AlreadyRegistered, self.registry.register, Impostor,
+            WidgetEndpoint)
+
+    def test_unregister(self):
+        from ajax.exceptions import NotRegistered
+        self.registry.unregister(Widget)
+        self.assertRaises(NotRegistered, self.registry.load, 'widget',
+            'example', 'get')
+        self.registry.register(Widget, WidgetEndpoint)
+
+
+class SerializerTests(BaseTest):
+    payload = {
+        'when': datetime.datetime(2011, 5, 7, 15, 19, 28, 123456,
+            tzinfo=timezone.utc),
+        'day': datetime.date(2011, 5, 7),
+        'price': decimal.Decimal('10.50'),
+        'uuid': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+        'title': escape('<b>'),
+        1: 'one',
+    }
+
+    def test_json_matches_django_encoder(self):
+        from ajax.serializers import JSONSerializer
+        content = JSONSerializer().dumps(self.payload)
+        self.assertEquals(json.dumps(self.payload, cls=DjangoJSONEncoder,
+            separators=(',', ':')), content.decode('utf-8'))
+
+    @unittest.skipIf(orjson is None, 'orjson is not installed')
+    def test_orjson_matches_json(self):
+        from ajax.serializers import JSONSerializer, ORJSONSerializer
+        self.assertEquals(
+            JSONSerializer().loads(JSONSerializer().dumps(self.payload)),
+            ORJSONSerializer().loads(ORJSONSerializer().dumps(self.payload)))
+
+    @unittest.skipIf(orjson is None, 'orjson is not installed')
+    def test_orjson_backend(self):
+        with self.settings(AJAX_JSON_BACKEND='orjson'):
+            resp, content = self.post('/ajax/example/echo.json',
+                {'name': 'Joe Stump', 'age': 31})
+            self.assertEquals('Joe Stump', content['data']['name'])
+
+            resp, content = self.post('/ajax/example/widget/99/get.json',
+                status_code=404)
+            self.assertFalse(content['success'])
+
+    def test_missing_backend_falls_back(self):
+        with mock.patch.multiple('ajax.serializers', orjson=None,
+            _serializer=(None, None)):
+            with self.settings(AJAX_JSON_BACKEND='orjson'):
+                resp, content = self.post('/ajax/example/echo.json',
+                    {'name': 'Joe Stump'})
+                self.assertEquals('Joe Stump', content['data']['name'])
+
+
+class BatchTests(BaseTest):
+    def batch(self, operations, status_code=200, **kwargs):
+        payload = dict(kwargs, operations=operations)
+        response = self.client.post('/ajax/batch.json', json.dumps(payload),
+            content_type='application/json')
+        self.assertEquals(status_code, response.status_code)
+        return json.loads(response.content.decode('utf-8'))
+
+    def test_batch(self):
+        content = self.batch([
+            {'application': 'example', 'model': 'widget', 'pk': 1,
+             'method': 'get'},
+            {'application': 'example', 'model': 'widget', 'pk': 2,
+             'method': 'update', 'data': {'title': 'Changed', 'active': False}},
+            {'application': 'example', 'model': 'echo',
+             'data': {'name': 'Joe Stump'}},
+            {'application': 'example', 'model': 'widget', 'pk': 99,
+             'method': 'get'},
+        ])
+        self.assertTrue(content['success'])
+        results = content['data']
+        self.assertEquals(1, results[0]['data']['pk'])
+        self.assertEquals('Changed', results[1]['data']['title'])
+        self.assertFalse(Widget.objects.get(pk=2).active)
+        self.assertEquals('Joe Stump', results[2]['data']['name'])
+        self.assertFalse(results[3]['success'])
+        self.assertEquals(404, results[3]['data']['code'])
+
+    def test_batch_form_encoded(self):
+        response = self.client.post('/ajax/batch.json', {'operations':
+            json.dumps([{'application': 'example', 'model': 'widget',
+                'pk': 1, 'method': 'get'}])})
+        content = json.loads(response.content.decode('utf-8'))
+        self.assertEquals(1, content['data'][0]['data']['pk'])
+
+    def test_batch_authenticates_each_operation(self):
+        self.client.logout()
+        content = self.batch([{'application': 'example', 'model': 'widget',
+            'pk': 1, 'method': 'get'}])
+        self.assertEquals(403, content['data'][0]['data']['code'])
+
+    def test_batch_bulk_create(self):
+        content = self.batch([{'application': 'example', 'model': 'widget',
+            'method': 'bulk_create', 'data': {'records': [
+                {'title': 'Batched one', 'category': 1},
+                {'title': 'Batched two', 'category': 1}]}}])
+        self.assertTrue(content['data'][0]['success'])
+        self.assertEquals(2, Widget.objects.filter(
+            title__startswith='Batched').count())
+
+    def test_atomic_batch_rolls_back(self):
+        content = self.batch([
+            {'application': 'example', 'model': 'widget', 'pk': 2,
+             'method': 'update', 'data': {'title': 'Changed'}},
+            {'application': 'example', 'model': 'widget', 'pk': 99,
+             'method': 'update', 'data': {'title': 'Changed'}},
+            {'application': 'example', 'model': 'widget', 'pk': 3,
+             'method': 'update', 'data': {'title': 'Changed'}},
+        ], atomic=True)
+        self.assertFalse(content['success'])
+        self.assertTrue(content['rolled_back'])
+        self.assertEquals(2, len(content['data']))
+        self.assertNotEquals('Changed', Widget.objects.get(pk=2).title)
+        self.assertNotEquals('Changed', Widget.objects.get(pk=3).title)
+
+    def test_failed_operation_rolls_back_alone(self):
+        def update(endpoint, request):
+            Widget.objects.filter(pk=endpoint.pk).update(title='Changed')
+            raise AJAXError(400, 'Failed after writing.')
+
+        with mock.patch.object(WidgetEndpoint, 'update', update):
+            content = self.batch([
+                {'application': 'example', 'model': 'widget', 'pk': 2,
+                 'method': 'update', 'data': {'title': 'Changed'}},
+                {'application': 'example', 'model': 'widget', 'pk': 3,
+                 'method': 'get'},
+            ])
+        self.assertEquals(400, content['data'][0]['data']['code'])
+        self.assertNotEquals('Changed', Widget.objects.get(pk=2).title)
+        self.assertEquals(3, content['data'][1]['data']['pk'])
+
+    def test_invalid_batch(self):
+        self.batch('nope', status_code=400)
+        with self.settings(AJAX_BATCH_MAX_OPERATIONS=1):
+            self.batch([{}, {}], status_code=400)
+
+
+class BulkTests(BaseTest):
+    def bulk(self, method, status_code=200, **kwargs):
+        data = dict((key, json.dumps(value)) for key, value in kwargs.items())
+        resp, content = self.post('/ajax/example/widget/%s.json' % method,
+            data, status_code=status_code)
+        return content
+
+    def test_bulk_create(self):
+        count = Widget.objects.count()
+        content = self.bulk('bulk_create', records=[
+            {'title': 'One', 'category': 1},
+            {'title': 'x' * 200},
+            {'title': 'Two', 'category': 2, 'active': False},
+            {'title': 'Three', 'category': 99},
+            'nope',
+        ])
+        results = content['data']
+        self.assertEquals([True, False, True, False, False],
+            [result['success'] for result in results])
+        self.assertEquals('One', results[0]['data']['title'])
+        self.assertTrue('title' in results[1]['errors'])
+        self.assertEquals(400, results[3]['data']['code'])
+        self.assertEquals(count + 2, Widget.objects.count())
+        self.assertFalse(Widget.objects.get(title='Two').active)
+
+    def test_failed_bulk_create_saves_nothing(self):
+        from django.db import DatabaseError
+        from django.db.models.sql.compiler import SQLInsertCompiler
+        execute_sql = SQLInsertCompiler.execute_sql
+        calls = []
+
+        def fail_second_batch(compiler, *args, **kwargs):
+            calls.append(compiler)
+            if len(calls) == 2:
+                raise DatabaseError('Batch failed.')
+            return execute_sql(compiler, *args, **kwargs)
+
+        count = Widget.objects.count()
+        with mock.patch.object(WidgetEndpoint, 'bulk_chunk_size', 1), \
+            mock.patch.object(SQLInsertCompiler, 'execute_sql',
+                fail_second_batch):
+            self.bulk('bulk_create', status_code=500, records=[
+                {'title': 'One', 'category': 1},
+                {'title': 'Two', 'category': 2},
+            ])
+        self.assertEquals(2, len(calls))
+        self.assertEquals(count, Widget.objects.count())
+
+    def test_bulk_update(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as queries:
+            content = self.bulk('bulk_update', records=[
+                {'pk': 1, 'title': 'Changed'},
+                {'pk': 2, 'title': 'Changed'},
+                {'pk': 3, 'active': False, 'category': 2},
+                {'pk': 99, 'title': 'Changed'},
+                {'title': 'Changed'},
+            ])
+
+        results = content['data']
+        self.assertEquals([True, True, True, False, False],
+            [result['success'] for result in results])
+        self.assertEquals(404, results[3]['data']['code'])
+        self.assertEquals(400, results[4]['data']['code'])
+        self.assertEquals(2, Widget.objects.filter(title='Changed').count())
+        self.assertEquals(2, Widget.objects.get(pk=3).category_id)
+
+        updates = [q['sql'] for q in queries if q['sql'].startswith('UPDATE')]
+        self.assertEquals(2, len(updates))
+
+    def test_bulk_update_checks_each_record(self):
+        def can_update(self, user, record, **kwargs):
+            return record.pk != 2
+        with mock.patch.object(WidgetEndpoint, 'can_update', can_update):
+            content = self.bulk('bulk_update', records=[
+                {'pk': 1, 'title': 'Changed'}, {'pk': 2, 'title': 'Changed'}])
+        self.assertEquals(403, content['data'][1]['data']['code'])
+        self.assertEquals('Changed', Widget.objects.get(pk=1).title)
+        self.assertNotEquals('Changed', Widget.objects.get(pk=2).title)
+
+    def test_bulk_delete(self):
+        receiver = mock.Mock(spec=lambda: None)
+        ajax_deleted.connect(receiver)
+        try:
+            with mock.patch.object(WidgetEndpoint, 'bulk_chunk_size', 1):
+                content = self.bulk('bulk_delete', pks=[1, 2, 99, 'x'])
+        finally:
+            ajax_deleted.disconnect(receiver)
+
+        results = content['data']
+        self.assertEquals({'pk': 1}, results[0]['data'])
+        self.assertEquals(404, results[2]['data']['code'])
+        self.assertEquals(400, results[3]['data']['code'])
+        self.assertFalse(Widget.objects.filter(pk__in=[1, 2]).exists())
+        self.assertEquals(2, receiver.call_count)
+
+    def test_invalid_bulk_request(self):
+        self.bulk('bulk_create', status_code=400)
+        self.bulk('bulk_create', records={'title': 'One'}, status_code=400)
+
+
+class ResponseCacheTests(BaseTest):
+    def setUp(self):
+        from django.core.cache import cache
+        super(ResponseCacheTests, self).setUp()
+        cache.clear()
+        patcher = mock.patch.object(WidgetEndpoint, 'cache_responses', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_get_is_cached(self):
+        resp, first = self.post('/ajax/example/widget/3/get.json')
+        with self.assertNumQueries(0):
+            endpoint = WidgetEndpoint('example', Widget, 'get', pk='3')
+            self.assertEqual(first['data'], endpoint.get(MockRequest()))
+
+        with mock.patch.object(WidgetEndpoint, 'sparse_fields', ['title']):
+            with self.assertNumQueries(1):
+                data = endpoint.get(MockRequest(fields='title'))
+        self.assertEqual(set(['pk', 'title']), set(data))
+
+        with mock.patch.object(WidgetEndpoint, 'can_get',
+            lambda self, user, record: record.pk != 3):
+            self.assertRaises(AJAXError, endpoint.get, MockRequest())
+
+        self.post('/ajax/example/widget/3/update.json', {'title': 'Changed'})
+        self.assertEqual('Changed', endpoint.get(MockRequest())['title'])
+
+    def test_list_is_cached(self):
+        list_endpoint = WidgetEndpoint('example', Widget, 'list')
+        first = list_endpoint.list(MockRequest(items_per_page='2'))
+        with self.assertNumQueries(0):
+            second = list_endpoint.list(MockRequest(items_per_page='2'))
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(first.metadata, second.metadata)
+
+        with self.assertNumQueries(2):
+            list_endpoint.list(MockRequest(items_per_page='3'))
+
+        self.post('/ajax/example/widget/1/delete.json')
+        with self.assertNumQueries(2):
+            third = list_endpoint.list(MockRequest(items_per_page='2'))
+        self.assertEqual(5, third.metadata['total'])
+
+
+class ConditionalRequestTests(BaseTest):
+    def test_etag(self):
+        for uri in ['/ajax/example/widget/3/get.json',
+            '/ajax/example/widget/list.json']:
+            response = self.client.post(uri)
+            etag = response['ETag']
+            response = self.client.post(uri, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(304, response.status_code)
+            self.assertEqual(b'', response.content)
+            self.assertEqual(etag, response['ETag'])
+
+            response = self.client.post(uri,
+                HTTP_IF_NONE_MATCH='"other", W/%s' % etag)
+            self.assertEqual(304, response.status_code)
+
+        Widget.objects.filter(pk=3).update(title='Changed')
+        response = self.client.post('/ajax/example/widget/3/get.json',
+            HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(200, response.status_code)
+
+        response = self.client.post('/ajax/example/widget/3/update.json',
+            {'title': 'Changed again'}, HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(200, response.status_code)
+        self.assertFalse(response.has_header('ETag'))
+
+    def test_etag_field(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        uri = '/ajax/example/widget/3/get.json'
+        with mock.patch.object(WidgetEndpoint, 'etag_field', 'title'):
+            etag = self.client.post(uri)['ETag']
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(uri, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(304, response.status_code)
+            self.assertTrue(queries[-1]['sql'].startswith('SELECT '
+                '"example_widget"."id", "example_widget"."title" FROM'))
+
+            Widget.objects.filter(pk=3).update(active=False)
+            response = self.client.post(uri, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(304, response.status_code)
+
+            Widget.objects.filter(pk=3).update(title='Changed')
+            response = self.client.post(uri, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(200, response.status_code)
+            self.assertNotEqual(etag, response['ETag'])
+
+
+class GetRequestTests(BaseTest):
+    def test_get_requires_opt_in(self):
+        response = self.client.get('/ajax/example/widget/3/get.json')
+        self.assertEqual(400, response.status_code)
+        response = self.client.get('/ajax/example/echo.json')
+        self.assertEqual(400, response.status_code)
+
+    def test_get(self):
+        with mock.patch.object(WidgetEndpoint, 'allow_get', True):
+            response = self.client.get('/ajax/example/widget/3/get.json')
+            self.assertEqual(200, response.status_code)
+            self.assertEqual('private', response['Cache-Control'])
+            content = json.loads(response.content.decode('utf-8'))
+            self.assertEqual(3, content['data']['pk'])
+
+            response = self.client.get('/ajax/example/widget/3/get.json',
+                HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(304, response.status_code)
+            self.assertEqual('private', response['Cache-Control'])
+
+            response = self.client.get('/ajax/example/widget/list.json',
+                {'items_per_page': 2})
+            content = json.loads(response.content.decode('utf-8'))
+            self.assertEqual(2, len(content['data']))
+
+            response = self.client.get('/ajax/example/widget/3/update.json',
+                {'title': 'Changed'})
+            self.assertEqual(400, response.status_code)
+            self.assertNotEqual('Changed', Widget.objects.get(pk=3).title)
+
+            self.client.logout()
+            response = self.client.get('/ajax/example/widget/3/get.json')
+            self.assertEqual(403, response.status_code)
+
+    def test_cache_headers(self):
+        with mock.patch.multiple(WidgetEndpoint, allow_get=True,
+            http_cache_control={'public': True, 'max_age': 60},
+            http_vary=('Authorization',)):
+            response = self.client.get('/ajax/example/widget/3/get.json')
+        self.assertEqual(set(['public', 'max-age=60']),
+            set(response['Cache-Control'].split(', ')))
+        self.assertTrue('Authorization' in response['Vary'])
+
+    def test_read_only_adhoc_endpoint(self):
+        response = self.client.get('/ajax/example/lookup.json', {'q': 'foo'})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('max-age=60', response['Cache-Control'])
+        self.assertTrue(response.has_header('ETag'))
+        content = json.loads(response.content.decode('utf-8'))
+        self.assertEqual({'q': 'foo'}, content['data'])
+
+        response = self.client.post('/ajax/example/lookup.json', {'q': 'foo'})
+        self.assertEqual(200, response.status_code)
+        self.assertFalse(response.has_header('Cache-Control'))
+
+
+class MetricsTests(BaseTest):
+    def setUp(self):
+        super(MetricsTests, self).setUp()
+        metrics.registry.reset()
+        self.addCleanup(metrics.registry.reset)
+
+    def test_disabled_by_default(self):
+        self.post('/ajax/example/widget/3/get.json')
+        self.assertEqual([], metrics.registry.snapshot())
+
+    def test_endpoint_metrics(self):
+        with self.settings(AJAX_METRICS=True):
+            response, content = self.post('/ajax/example/widget/3/get.json')
+            self.post('/ajax/example/widget/99/get.json', status_code=404)
+            self.post('/ajax/example/nope.json', status_code=500)
+
+        stats = metrics.registry.get('example', 'widget', 'get')
+        self.assertEqual(2, stats.request_seconds.count)
+        self.assertEqual({200: 1, 404: 1}, stats.responses)
+        self.assertTrue(stats.queries.sum >= 2)
+        self.assertEqual(stats.queries.count, stats.query_seconds.count)
+        self.assertTrue(stats.encode_seconds.sum > 0)
+        self.assertTrue(stats.serialize_seconds.sum > 0)
+        self.assertEqual(2, stats.response_bytes.count)
+
+        unresolved = metrics.registry.get('', '', '')
+        self.assertEqual({500: 1}, unresolved.responses)
+
+    def test_list_encode_time(self):
+        with self.settings(AJAX_METRICS=True):
+            self.post('/ajax/example/widget/list.json')
+
+        stats = metrics.registry.get('example', 'widget', 'list')
+        self.assertTrue(stats.encode_seconds.sum > 0)
+        self.assertEqual(1, stats.queries.count)
+
+    def test_prometheus(self):
+        with self.settings(AJAX_METRICS=True):
+            self.post('/ajax/example/widget/3/get.json')
+
+        text = metrics.prometheus_view(None).content.decode('utf-8')
+        labels = 'application="example",model="widget",method="get"'
+        self.assertTrue('# TYPE ajax_request_seconds histogram' in text)
+        self.assertTrue('ajax_request_seconds_bucket{%s,le="+Inf"} 1' %
+            labels in text)
+        self.assertTrue('ajax_request_seconds_count{%s} 1' % labels in text)
+        self.assertTrue('ajax_responses_total{%s,status="200"} 1' % labels
+            in text)
+
+    def test_sinks(self):
+        samples = []
+
+        def receiver(sender, sample, **kwargs):
+            samples.append(sample)
+
+        ajax_request_finished.connect(receiver)
+        self.addCleanup(ajax_request_finished.disconnect, receiver)
+        with self.settings(AJAX_METRICS=True,
+            AJAX_METRICS_SINKS=['ajax.metrics.SignalSink']):
+            self.post('/ajax/example/widget/3/get.json')
+
+        self.assertEqual(1, len(samples))
+        self.assertEqual(('example', 'widget', 'get'), samples[0].key)
+        self.assertEqual(200, samples[0].status)
+
+        lines = metrics.StatsdSink().format(samples[0]).decode().split('\n')
+        self.assertTrue(lines[0].startswith('ajax.example.widget.get.request:'))
+        self.assertTrue(lines[0].endswith('|ms'))
+        self.assertEqual('ajax.example.widget.get.status.200:1|c', lines[-1])
+
+    def test_failing_sink(self):
+        with mock.patch.object(metrics.SignalSink, 'emit',
+            side_effect=ValueError):
+            with self.settings(AJAX_METRICS=True,
+                AJAX_METRICS_SINKS=['ajax.metrics.SignalSink']):
+                self.post('/ajax/example/widget/3/get.json')
+
+        self.assertEqual(1, metrics.registry.get('example', 'widget',
+            'get').request_seconds.count)
+
+
+class ProfilingTests(BaseTest):
+    def setUp(self):
+        super(ProfilingTests, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def profiles(self):
+        return sorted(os.listdir(self.directory))
+
+    def test_disabled_by_default(self):
+        response = self.client.post('/ajax/example/widget/3/get.json',
+            HTTP_X_AJAX_PROFILE='1')
+        self.assertFalse(response.has_header('X-AJAX-Profile-Id'))
+
+    def test_sample_rate(self):
+        with self.settings(AJAX_PROFILE_DIR=self.directory,
+            AJAX_PROFILE_RATE=1):
+            response = self.client.post('/ajax/example/widget/3/get.json',
+                HTTP_X_REQUEST_ID='abc123')
+
+        self.assertEqual('abc123', response['X-AJAX-Profile-Id'])
+        self.assertEqual(['ajax.example.widget.3.get.abc123.pstats'],
+            self.profiles())
+        stats = pstats.Stats(os.path.join(self.directory, self.profiles()[0]))
+        self.assertTrue(any(name == 'get' for filename, line, name in
+            stats.stats))
+
+        with self.settings(AJAX_PROFILE_DIR=self.directory,
+            AJAX_PROFILE_RATE=0):
+            response = self.client.post('/ajax/example/widget/3/get.json')
+        self.assertFalse(response.has_header('X-AJAX-Profile-Id'))
+        self.assertEqual(1, len(self.profiles()))
+
+    def test_header_requires_staff(self):
+        with self.settings(AJAX_PROFILE_DIR=self.directory):
+            response = self.client.post('/ajax/example/widget/3/get.json',
+                HTTP_X_AJAX_PROFILE='1')
+            self.assertTrue(response.has_header('X-AJAX-Profile-Id'))
+
+            User.objects.filter(username='jstump').update(is_staff=False)
+            response = self.client.post('/ajax/example/widget/3/get.json',
+                HTTP_X_AJAX_PROFILE='1')
+            self.assertFalse(response.has_header('X-AJAX-Profile-Id'))
+
+        self.assertEqual(1, len(self.profiles()))
+
+    def test_sampler(self):
+        with self.settings(AJAX_PROFILE_DIR=self.directory,
+            AJAX_PROFILER='sampler'):
+            response = self.client.post('/ajax/example/widget/3/get.json',
+                HTTP_X_AJAX_PROFILE='1')
+        self.assertEqual(['ajax.example.widget.3.get.%s.collapsed' %
+            response['X-AJAX-Profile-Id']], self.profiles())
+
+        sampler = profiling.StackSampler(interval=0.001)
+        sampler.start()
+        time.sleep(0.05)
+        sampler.stop()
+        sampler.save(os.path.join(self.directory, 'sleep.collapsed'))
+        with open(os.path.join(self.directory, 'sleep.collapsed')) as f:
+            lines = f.read().splitlines()
+        self.assertTrue(lines)
+        self.assertTrue(all('test_sampler' in line for line in lines))
+
+
+class BenchmarkTests(TestCase):
+    def test_run(self):
+        results = benchmarks.run([30], min_time=0, repeat=2)
+        self.assertEqual(30, Widget.objects.filter(category__isnull=False)
+            .count())
+        names = [result['name'] for result in results]
+        self.assertTrue('encode.expand' in names)
+        self.assertTrue('list.last' in names)
+        self.assertTrue(all(result['size'] == 30 for result in results))
+        self.assertEqual('record', results[0]['unit'])
+        self.assertEqual(30, results[0]['number'])
+
+        rows = benchmarks.compare(results, results)
+        self.assertEqual(len(results), len(rows))
+        self.assertTrue(all(row[4] == 0 for row in rows))
+
+        results = benchmarks.run([30], min_time=0, repeat=1,
+            only=['dispatch'])
+        self.assertEqual(['dispatch.adhoc', 'dispatch.get'],
+            [result['name'] for result in results])
+
+
+class BudgetTests(testing.BudgetTestMixin, BaseTest):
+    def setUp(self):
+        super(BudgetTests, self).setUp()
+        self.user = User.objects.get(username='jstump')
+
+    def test_assert_budget(self):
+        response, usage = self.assertBudget('example', 'widget', 'get', pk=3,
+            user=self.user, queries=1)
+        self.assertEqual(1, usage.queries)
+        self.assertRaises(AssertionError, self.assertBudget, 'example',
+            'widget', 'get', pk=3, user=self.user, queries=0)
+        self.assertRaises(AssertionError, self.assertBudget, 'example',
+            'widget', 'get', pk=99, user=self.user)
+
+    def test_declared_budgets(self):
+        with mock.patch.multiple(WidgetEndpoint, query_budgets={'list': 1},
+            memory_budgets={'list': 10 ** 8}):
+            self.assertEqual((1, 10 ** 8),
+                testing.get_budget('example', 'widget', 'list'))
+            response, usage = testing.call_endpoint('example', 'widget',
+                'list', user=self.user)
+            self.assertEqual(['ran 2 queries, the budget is 1'],
+                testing.check_budget('example', 'widget', 'list', usage))
+
+        self.assertEqual((None, None), testing.get_budget('example', 'echo'))
+        with mock.patch.object(example_endpoints.echo, 'ajax_budget', (0, 0),
+            create=True):
+            self.assertEqual((0, 0), testing.get_budget('example', 'echo'))
+
+    @unittest.skipIf(testing.tracemalloc is None, 'Needs tracemalloc.')
+    def test_memory_budget(self):
+        response, usage = self.assertBudget('example', 'widget', 'list',
+            user=self.user, memory=10 ** 8)
+        self.assertTrue(usage.peak_memory > 0)
+        self.assertRaises(AssertionError, self.assertBudget, 'example',
+            'widget', 'list', user=self.user, memory=1)
+
+    def test_sweep(self):
+        count = Widget.objects.count()
+        self.assertEqual([], testing.sweep(self.user, rows=5))
+        self.assertEqual(count, Widget.objects.count())
+
+        def encode(record, **kwargs):
+            # One query per record.
+            return Widget.objects.filter(pk=record.pk).exists()
+
+        from ajax.encoders import encoder
+        with mock.patch.object(encoder, 'encode', encode):
+            violations = testing.sweep(self.user, rows=5, methods=['list'])
+        self.assertEqual(1, len(violations))
+        self.assertEqual(('example', 'widget', 'list'), violations[0][:3])
+        self.assertTrue('for 5 records but' in str(violations[0]))
+
+        with mock.patch.object(WidgetEndpoint, 'query_budgets', {'get': 0}):
+            violations = testing.sweep(self.user, rows=2, methods=['get'])
+        self.assertEqual(['example/widget/get: ran 1 queries, the budget is '
+            '0'], [str(violation) for violation in violations])
+
+    def test_sweep_survives_database_errors(self):
+        def create(self, request):
+            # A duplicate primary key.
+            Widget(pk=Widget.objects.all()[0].pk, title='Copy').save(
+                force_insert=True)
+
+        with mock.patch.object(WidgetEndpoint, 'create', create), \
+            mock.patch.object(WidgetEndpoint, 'query_budgets', {'update': 0}):
+            violations = testing.sweep(self.user, rows=2,
+                methods=['create', 'update', 'list', 'delete'])
+        violations = [violation for violation in violations
+            if violation.model == 'widget']
+        self.assertEqual(['create', 'update'], [violation.method
+            for violation in violations])
+        self.assertTrue('returned 500' in violations[0].message)
+        # Measured like any other call, without the savepoint's queries.
+        usage = testing.call_endpoint('example', 'widget', 'update',
+            pk=Widget.objects.all()[0].pk, data={'title': 'Changed'},
+            user=self.user)[1]
+        self.assertEqual('ran %d queries, the budget is 0' % usage.queries,
+            violations[1].message)
+
+    def test_sweep_needs_rows(self):
+        self.assertRaises(ValueError, testing.sweep, self.user, rows=0)
+        with self.assertRaises(CommandError):
+            call_command('ajax_budgets', '--rows=0')
+
+    def test_synthetic_data(self):
+        values = testing.synthetic_values(User, 4)
+        self.assertEqual('username-4', values['username'])
+        self.assertEqual({'title': 'title-2'},
+            testing.synthetic_data(Widget, 2))
+
+
+class APIKeyTests(TestCase):
+    fixtures = ['users.json', 'categories.json', 'widgets.json']
+
+    def setUp(self):
+        self.user = User.objects.get(username='jstump')
+        self.api_key, self.key = APIKey.objects.create_key(self.user, 'test')
+        patcher = mock.patch.object(WidgetEndpoint, 'authentication',
+            APIKeyAuthentication())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        # Keys are only cached with a cache processes share.
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        shared_cache = self.settings(CACHES={
+            'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            },
+            'shared': {
+                'BACKEND': 'django.core.cache.backends.filebased.'
+                    'FileBasedCache',
+                'LOCATION': directory,
+            },
+        }, AJAX_CACHE='shared')
+        shared_cache.enable()
+        self.addCleanup(shared_cache.disable)
+
+    def get(self, key=None, **headers):
+        if key is not None:
+            headers['HTTP_AUTHORIZATION'] = 'Bearer %s' % key
+        return self.client.post('/ajax/example/widget/3/get.json', **headers)
+
+    def test_create_key(self):
+        self.assertEqual(hash_key(self.key), self.api_key.hashed_key)
+        self.assertEqual(self.key[:8], self.api_key.prefix)
+        self.assertFalse(APIKey.objects.filter(hashed_key=self.key).exists())
+
+    def test_cached(self):
+        with self.assertNumQueries(2):
+            self.assertEqual(200, self.get(self.key).status_code)
+        with self.assertNumQueries(1):
+            self.assertEqual(200, self.get(self.key).status_code)
+
+        response = self.get(HTTP_X_API_KEY=self.key)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(403, self.get('nope').status_code)
+
+    def test_not_cached_in_local_memory(self):
+        with self.settings(AJAX_CACHE='default'):
+            for i in range(2):
+                with self.assertNumQueries(2):
+                    self.assertEqual(200, self.get(self.key).status_code)
+
+            self.api_key.revoke()
+            self.assertEqual(403, self.get(self.key).status_code)
+
+    def test_revoke(self):
+        self.assertEqual(200, self.get(self.key).status_code)
+        self.api_key.revoke()
+        self.assertEqual(403, self.get(self.key).status_code)
+
+        api_key, key = APIKey.objects.create_key(self.user)
+        self.assertEqual(200, self.get(key).status_code)
+        api_key.delete()
+        self.assertEqual(403, self.get(key).status_code)
+
+    def test_expired_key(self):
+        APIKey.objects.filter(pk=self.api_key.pk).update(
+            expires=timezone.now() - datetime.timedelta(minutes=1))
+        self.assertEqual(403, self.get(self.key).status_code)
+
+    def test_inactive_user(self):
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(403, self.get(self.key).status_code)
+
+    def test_session_fallback(self):
+        self.assertEqual(403, self.get().status_code)
+        self.client.login(username='jstump', password='testing')
+        self.assertEqual(200, self.get().status_code)
+
+    def test_keys_skip_csrf_checks(self):
+        client = Client(enforce_csrf_checks=True)
+        authorization = 'Bearer %s' % self.key
+        with mock.patch.object(ModelEndpoint, 'authentication',
+            APIKeyAuthentication()):
+            response = client.post('/ajax/example/widget/3/update.json',
+                {'title': 'Keyed'}, HTTP_AUTHORIZATION=authorization)
+            self.assertEqual(200, response.status_code)
+            self.assertEqual('Keyed', Widget.objects.get(pk=3).title)
+
+            # Ad-hoc endpoints act as the key's user.
+            response = client.post('/ajax/example/echo.json',
+                {'name': 'Joe'}, HTTP_AUTHORIZATION=authorization)
+            self.assertEqual(200, response.status_code)
+
+            response = client.post('/ajax/batch.json', {'operations':
+                json.dumps([{'application': 'example', 'model': 'echo'}])},
+                HTTP_AUTHORIZATION=authorization)
+            content = json.loads(response.content.decode('utf-8'))
+            self.assertTrue(content['data'][0]['success'])
+
+            response = client.post('/ajax/example/echo.json',
+                HTTP_AUTHORIZATION='Bearer nope')
+            self.assertEqual(403, response.status_code)
+            self.assertEqual('application/json', response['Content-Type'])
+
+            # Session requests still need a CSRF token.
+            client.login(username='jstump', password='testing')
+            response = client.post('/ajax/example/widget/3/update.json',
+                {'title': 'Session'})
+            self.assertEqual(403, response.status_code)
+            self.assertEqual('Keyed', Widget.objects.get(pk=3).title)
+
+            client.cookies['csrftoken'] = 'a' * 32
+            response = client.post('/ajax/example/widget/3/update.json',
+                {'title': 'Session', 'csrfmiddlewaretoken': 'a' * 32})
+            self.assertEqual(200, response.status_code)
+
+    def test_key_lookup_errors_are_json(self):
+        from django.db import DatabaseError
+        authentication = APIKeyAuthentication()
+        with mock.patch.object(ModelEndpoint, 'authentication',
+            authentication), mock.patch.object(authentication, 'get_user',
+            side_effect=DatabaseError('Down.')):
+            response = self.client.post('/ajax/example/echo.json',
+                HTTP_AUTHORIZATION='Bearer %s' % self.key)
+        self.assertEqual(500, response.status_code)
+        self.assertEqual('application/json', response['Content-Type'])
+        content = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(500, content['data']['code'])
+
+    def test_command(self):
+        out = six.StringIO()
+        call_command('ajax_api_key', 'jstump', '--name=cli', stdout=out)
+        key = out.getvalue().strip()
+        self.assertEqual('cli', APIKey.objects.get(hashed_key=hash_key(
+            key)).name)
+        self.assertEqual(200, self.get(key).status_code)
+
+
 class MockRequest(object):
     def __init__(self, **kwargs):
         self.POST = kwargs
@@ -143,6 +1100,255 @@ class ModelEndpointTests(BaseTest):
         results = self.list_endpoint.list(MockRequest(items_per_page=2))
         self.assertEqual(len(results.data), 1)
 
+    def test_items_per_page_is_parsed_and_clamped(self):
+        results = self.list_endpoint.list(MockRequest(items_per_page='2'))
+        self.assertEqual(2, len(results.data))
+        results = self.list_endpoint.list(MockRequest(items_per_page='0'))
+        self.assertEqual(1, len(results.data))
+        results = self.list_endpoint.list(MockRequest(items_per_page='many'))
+        self.assertEqual(Widget.objects.count(), len(results.data))
+
+    @mock.patch.object(WidgetEndpoint, 'count_strategy', 'cached')
+    def test_cached_count(self):
+        from django.core.cache import cache
+        from ajax.signals import ajax_created
+        cache.clear()
+        results = self.list_endpoint.list(MockRequest())
+        self.assertEqual({'total': 6, 'total_exact': True}, results.metadata)
+
+        Widget.objects.filter(pk=1).delete()
+        with self.assertNumQueries(1):
+            results = self.list_endpoint.list(MockRequest(current_page='2',
+                items_per_page='4'))
+        self.assertEqual(1, len(results.data))
+        self.assertEqual({'total': 6, 'total_exact': False}, results.metadata)
+
+        widget = Widget.objects.create(title='New')
+        ajax_created.send(sender=Widget, instance=widget)
+        results = self.list_endpoint.list(MockRequest())
+        self.assertEqual({'total': 6, 'total_exact': True}, results.metadata)
+
+        # Only endpoints with cached counts keep a version.
+        category = Category.objects.create(title='New')
+        ajax_created.send(sender=Category, instance=category)
+        self.assertEqual(None, cache.get('ajax.count.example.category'))
+
+    def test_counted_page_out_of_range_is_not_queried(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.list_endpoint.count_strategy = 'cached'
+        with self.assertNumQueries(1):
+            results = self.list_endpoint.list(MockRequest(current_page='3',
+                items_per_page='4'))
+        self.assertEqual([], list(results.data))
+        self.assertEqual({'total': 6, 'total_exact': True}, results.metadata)
+
+    def test_estimated_and_omitted_count(self):
+        self.list_endpoint.count_strategy = 'estimated'
+        results = self.list_endpoint.list(MockRequest())
+        self.assertEqual({'total': 6, 'total_exact': True}, results.metadata)
+
+        self.list_endpoint.count_strategy = None
+        with self.assertNumQueries(1):
+            results = self.list_endpoint.list(MockRequest(current_page='x'))
+        self.assertEqual({}, results.metadata)
+        self.assertEqual(6, len(results.data))
+
+    def test_sparse_fields(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        self.list_endpoint.sparse_fields = ['title', 'active']
+        with CaptureQueriesContext(connection) as queries:
+            results = self.list_endpoint.list(MockRequest(fields='title'))
+        self.assertEqual(set(['pk', 'title']), set(results.data[0]))
+        self.assertFalse('"active"' in queries[-1]['sql'])
+        self.assertFalse('"description"' in queries[-1]['sql'])
+
+        endpoint = WidgetEndpoint('example', Widget, 'get', pk=3)
+        endpoint.sparse_fields = ['title', 'category']
+        with self.assertNumQueries(1):
+            record = endpoint.get(MockRequest(fields='category, title'))
+        self.assertEqual({'pk': 3, 'category': 1,
+            'title': 'Sorem ipsum dolor lit amet'}, record)
+
+        self.assertRaises(AJAXError, self.list_endpoint.list,
+            MockRequest(fields='title,description'))
+
+    def test_sparse_fields_respect_encoder(self):
+        from ajax.encoders import encoder, IncludeEncoder
+        self.list_endpoint.sparse_fields = ['title', 'active']
+        encoder.register(Widget, IncludeEncoder(['active', 'description']))
+        try:
+            results = self.list_endpoint.list(
+                MockRequest(fields='title,active'))
+        finally:
+            encoder.unregister(Widget)
+        self.assertEqual(set(['pk', 'active']), set(results.data[0]))
+
+    def test_sparse_fields_with_custom_encoder(self):
+        from ajax.encoders import encoder
+
+        def encode_widget(record, html_escape=False):
+            return {'title': record.title}
+
+        self.login('jstump')
+        widget = Widget.objects.get(pk=1)
+        encoder.register(Widget, encode_widget)
+        try:
+            self.assertEqual({'title': widget.title},
+                encoder.encode(widget, fields=['active']))
+            with mock.patch.object(WidgetEndpoint, 'sparse_fields',
+                ['title', 'active']):
+                resp, content = self.post('/ajax/example/widget/list.json',
+                    {'fields': 'title'}, status_code=400)
+                resp, content = self.post('/ajax/example/widget/list.json')
+        finally:
+            encoder.unregister(Widget)
+        self.assertEqual(['title'], list(content['data'][0]))
+
+    def test_list_values(self):
+        from ajax.encoders import encoder, ExcludeEncoder
+        Widget.objects.filter(pk=2).update(description='<b>Bold</b>')
+        expected = self.list_endpoint.list(MockRequest()).data
+        self.list_endpoint.list_values = True
+        with mock.patch.object(Widget, '__init__') as init:
+            results = self.list_endpoint.list(MockRequest())
+        self.assertFalse(init.called)
+        self.assertEqual(expected, results.data)
+
+        self.list_endpoint.sparse_fields = ['title', 'active']
+        encoder.register(Widget, ExcludeEncoder(['active']))
+        try:
+            results = self.list_endpoint.list(MockRequest(fields='title,active'))
+        finally:
+            encoder.unregister(Widget)
+        self.assertEqual(set(['pk', 'title']), set(results.data[0]))
+
+    def test_list_values_with_instance_extra_fields(self):
+        from django.db.models.signals import post_init
+
+        def add_extra_fields(sender, instance, **kwargs):
+            instance.extra_fields = {'label': 'Widget'}
+
+        post_init.connect(add_extra_fields, sender=Widget)
+        try:
+            expected = self.list_endpoint.list(MockRequest()).data
+            self.list_endpoint.list_values = True
+            results = self.list_endpoint.list(MockRequest())
+        finally:
+            post_init.disconnect(add_extra_fields, sender=Widget)
+        self.assertEqual('Widget', expected[0]['label'])
+        self.assertEqual(expected, results.data)
+
+    def test_list_values_falls_back(self):
+        from ajax.encoders import encoder
+        self.assertNotEqual(None, encoder.get_values_plan(Widget))
+        with mock.patch.object(Widget, 'extra_fields', {}, create=True):
+            self.assertEqual(None, encoder.get_values_plan(Widget))
+        with mock.patch.object(Widget, '__exclude__', lambda self: [],
+            create=True):
+            self.assertEqual(None, encoder.get_values_plan(Widget))
+        encoder.register(Widget, lambda record, **kwargs: {})
+        try:
+            self.assertEqual(None, encoder.get_values_plan(Widget))
+        finally:
+            encoder.unregister(Widget)
+
+    def test_list_filters(self):
+        self.list_endpoint.filter_fields = {
+            'title': ['exact', 'startswith'],
+            'category': ['in'],
+            'active': ['exact'],
+            'id': ['range'],
+        }
+
+        def pks(**kwargs):
+            results = self.list_endpoint.list(MockRequest(**kwargs))
+            return sorted(record['pk'] for record in results.data)
+
+        self.assertEqual(list(Widget.objects.filter(active=False)
+            .values_list('pk', flat=True)), pks(active='false'))
+        self.assertEqual([3], pks(title='Sorem ipsum dolor lit amet'))
+        self.assertEqual([1], pks(title__startswith='Iorem'))
+        self.assertEqual([2, 3, 4], pks(id__range='2,4'))
+        self.assertEqual(list(Widget.objects.filter(category__in=[1, 2])
+            .values_list('pk', flat=True).order_by('pk')),
+            pks(category__in='1, 2'))
+        # Undeclared lookups are ignored.
+        self.assertEqual(6, len(pks(description='x', title__contains='x')))
+
+        self.assertRaises(AJAXError, self.list_endpoint.list,
+            MockRequest(id__range='1'))
+        self.assertRaises(AJAXError, self.list_endpoint.list,
+            MockRequest(category__in='1,x'))
+
+    def test_list_ordering(self):
+        self.list_endpoint.order_fields = ['title', 'active']
+        results = self.list_endpoint.list(MockRequest(order_by='-active,title'))
+        self.assertEqual(list(Widget.objects.order_by('-active', 'title', 'pk')
+            .values_list('pk', flat=True)),
+            [record['pk'] for record in results.data])
+        self.assertRaises(AJAXError, self.list_endpoint.list,
+            MockRequest(order_by='description'))
+
+    def test_index_check(self):
+        from ajax.checks import check_endpoint_indexes
+        self.assertEqual([], check_endpoint_indexes())
+        with mock.patch.multiple(WidgetEndpoint, filter_fields={'id': ['in'],
+            'category': ['exact'], 'title': ['exact']},
+            order_fields=['-active']):
+            warnings = check_endpoint_indexes()
+        self.assertEqual(['ajax.W001', 'ajax.W001'],
+            [warning.id for warning in warnings])
+        self.assertTrue('"active"' in warnings[0].msg)
+        self.assertTrue('"title"' in warnings[1].msg)
+
+    def test_field_check(self):
+        from ajax.checks import check_endpoint_fields, check_endpoint_indexes
+        self.assertEqual([], check_endpoint_fields())
+        with mock.patch.multiple(WidgetEndpoint, filter_fields={
+            'tags': ['exact'], 'category': ['exact']},
+            order_fields=['-pk', 'nope'], cursor_ordering=['-missing']):
+            errors = check_endpoint_fields()
+            self.assertEqual([], check_endpoint_indexes())
+        self.assertEqual(['ajax.E001'] * 3, [error.id for error in errors])
+        self.assertTrue('"missing"' in errors[0].msg)
+        self.assertTrue('"nope"' in errors[1].msg)
+        self.assertTrue('"tags"' in errors[2].msg)
+
+    def test_cursor_pagination(self):
+        expected = list(Widget.objects.order_by('-active', 'title', 'pk')
+            .values_list('pk', flat=True))
+        self.list_endpoint.cursor_ordering = ['-active', 'title']
+
+        pages = []
+        cursor = None
+        while True:
+            with self.assertNumQueries(1):
+                results = self.list_endpoint.list(MockRequest(
+                    items_per_page='4', cursor=cursor))
+            self.assertFalse('total' in results.metadata)
+            pages.append([record['pk'] for record in results.data])
+            cursor = results.metadata['next']
+            if cursor is None:
+                break
+
+        self.assertEqual([expected[:4], expected[4:]], pages)
+        self.assertEqual(None, self.list_endpoint.list(
+            MockRequest(items_per_page=4)).metadata['prev'])
+
+        results = self.list_endpoint.list(MockRequest(items_per_page=4,
+            cursor=results.metadata['prev']))
+        self.assertEqual(expected[:4], [record['pk'] for record in results.data])
+        self.assertEqual(None, results.metadata['prev'])
+        self.assertNotEqual(None, results.metadata['next'])
+
+    def test_invalid_cursor(self):
+        self.list_endpoint.cursor_ordering = ['title']
+        for cursor in ['nope', 'WzAsWzFdXQ', 'WzAsWyJ4IiwieCJdXQ']:
+            self.assertRaises(AJAXError, self.list_endpoint.list,
+                MockRequest(cursor=cursor))
+
     def test_list_has_permission__default_empty(self):
         Category.objects.create(title='test')
 
@@ -151,6 +1357,64 @@ class ModelEndpointTests(BaseTest):
         results = self.category_endpoint.list(MockRequest())
         self.assertEqual(0, len(results.data))
 
+    def test_list_applies_select_related(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        self.list_endpoint.select_related = ['category']
+        with CaptureQueriesContext(connection) as queries:
+            self.list_endpoint.list(MockRequest())
+        self.assertTrue('example_category' in queries[-1]['sql'])
+
+    def test_metadata_is_shared(self):
+        endpoint = WidgetEndpoint('example', Widget, 'update', pk=1)
+        self.assertTrue(endpoint.metadata is self.list_endpoint.metadata)
+        self.assertTrue(isinstance(endpoint.metadata.fields['category'],
+            models.ForeignKey))
+        self.assertEquals(Category,
+            endpoint.metadata.foreign_keys['category'])
+
+    def test_metadata_follows_immutable_fields(self):
+        request = MockRequest(title='changed', active='false')
+        endpoint = WidgetEndpoint('example', Widget, 'update', pk=1)
+        self.assertEquals({'title': 'changed', 'active': False},
+            endpoint._extract_data(request))
+
+        with mock.patch.object(WidgetEndpoint, 'immutable_fields', ['title']):
+            endpoint = WidgetEndpoint('example', Widget, 'update', pk=1)
+            self.assertEquals({'active': False},
+                endpoint._extract_data(request))
+
+        endpoint = WidgetEndpoint('example', Widget, 'update', pk=1)
+        self.assertTrue('title' in endpoint._extract_data(request))
+
+    def test_foreign_keys_resolved_in_one_query(self):
+        endpoint = WidgetEndpoint('example', Widget, 'create')
+        with self.assertNumQueries(1):
+            data = endpoint._extract_data(MockRequest(category='2',
+                title='Widget'))
+        self.assertEquals(Category.objects.get(pk=2), data['category'])
+        self.assertEquals(None, endpoint._extract_data(
+            MockRequest(category=''))['category'])
+        self.assertRaises(Category.DoesNotExist, endpoint._extract_data,
+            MockRequest(category='99'))
+
+    def test_foreign_key_cache(self):
+        from ajax.endpoints import related_cache
+        from ajax.signals import ajax_updated
+        related_cache(Category).clear()
+        request = MockRequest(category='2')
+        with mock.patch.object(WidgetEndpoint, 'foreign_key_cache',
+            {Category: 60}):
+            endpoint = WidgetEndpoint('example', Widget, 'create')
+            with self.assertNumQueries(1):
+                endpoint._extract_data(request)
+            with self.assertNumQueries(0):
+                category = endpoint._extract_data(request)['category']
+
+            ajax_updated.send(sender=Category, instance=category)
+            with self.assertNumQueries(1):
+                endpoint._extract_data(request)
+
     def test_list_has_total(self):
         self.category_endpoint.can_list = lambda *args, **kwargs: True
 
@@ -180,6 +1444,21 @@ class ModelEndpointPostTests(TestCase):
         self.assertTrue('total' in list(content.keys()))
         self.assertEquals(content['total'], 3)
 
+    def test_can_stream_list(self):
+        self.client.login(username='test', password='password')
+
+        resp = self.client.post('/ajax/example/widget/list.json')
+        expected = json.loads(resp.content.decode('utf-8'))
+
+        with mock.patch.multiple(WidgetEndpoint, stream_list=True,
+            stream_chunk_size=2, create=True):
+            resp = self.client.post('/ajax/example/widget/list.json')
+
+        self.assertTrue(resp.streaming)
+        self.assertEquals('application/json', resp['Content-Type'])
+        content = b''.join(resp.streaming_content).decode('utf-8')
+        self.assertEquals(expected, json.loads(content))
+
     def test_delete(self):
         widget = Widget.objects.all()[0]
 